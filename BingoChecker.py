@@ -4,97 +4,47 @@ Created on Fri Nov  8 16:00:00 2024
 
 @author: egumon
 """
-class BingoCard:
-    def __init__(self, card_number, numbers):
-        """
-        ビンゴカードを初期化する
-        :param card_number: カード番号
-        :param numbers: 5x5の数字リスト
-        """
-        self.card_number = card_number
-        self.numbers = numbers
-        self.marked = [[False for _ in range(5)] for _ in range(5)]
-        # 中央のFREEマスを既にマークされた状態にする
-        self.marked[2][2] = True
-
-    def mark_number(self, called_number):
-        """
-        呼ばれた番号をマークする
-        :param called_number: 呼ばれた番号
-        :return: マークされたかどうか
-        """
-        if called_number.upper() == 'FREE':
-            return False
-            
-        try:
-            number = int(called_number)
-            for i in range(5):
-                for j in range(5):
-                    if self.numbers[i][j] == number:
-                        self.marked[i][j] = True
-                        return True
-            return False
-        except ValueError:
-            return False
 
-    def check_bingo(self):
-        """
-        ビンゴになっているかチェックする
-        :return: ビンゴパターンのリスト
-        """
-        bingo_patterns = []
+import argparse
+import json
+import os
+import sys
 
-        # 横のチェック
-        for i, row in enumerate(self.marked):
-            if all(row):
-                bingo_patterns.append(f"横{i+1}行目")
+from bingo_engine.engine import BACKENDS, CardGame, game_from_dicts
+from bingo_engine.game import BingoCard
 
-        # 縦のチェック
+def display_card(card):
+    """
+    現在のカードの状態を表示する
+    """
+    print(f"Card No.{card.card_number}")
+    for i in range(5):
         for j in range(5):
-            if all(self.marked[i][j] for i in range(5)):
-                bingo_patterns.append(f"縦{j+1}列目")
-
-        # 斜めのチェック（左上から右下）
-        if all(self.marked[i][i] for i in range(5)):
-            bingo_patterns.append("斜め（左上から右下）")
-
-        # 斜めのチェック（右上から左下）
-        if all(self.marked[i][4-i] for i in range(5)):
-            bingo_patterns.append("斜め（右上から左下）")
-
-        return bingo_patterns
-
-    def display(self):
-        """
-        現在のカードの状態を表示する
-        """
-        print(f"Card No.{self.card_number}")
-        for i in range(5):
-            for j in range(5):
-                if i == 2 and j == 2:
-                    print("FREE\t", end="")
-                else:
-                    mark = "X" if self.marked[i][j] else " "
-                    print(f"{self.numbers[i][j]}{mark}\t", end="")
-            print()
+            if i == 2 and j == 2:
+                print("FREE\t", end="")
+            else:
+                mark = "X" if card.marked[i][j] else " "
+                print(f"{card.numbers[i][j]}{mark}\t", end="")
         print()
+    print()
 
 def run_interactive_bingo(cards):
     """
     対話形式でビンゴゲームを実行する
     :param cards: BingoCardのリスト
     """
-    bingo_cards = {}  # カードごとのビンゴパターンを記録
+    # 番号 → その番号を持つカードの転置インデックスで、呼ばれた番号を持つカードだけを調べる
+    game = CardGame(cards)
     used_numbers = set()
     flag=0
     bingo_history = []  # ビンゴの履歴を保持する
-    
+
     while True:
         # 現在のカードの状態を表示
         print("********************************************************")
         print("\n現在のカードの状態:")
-        for card in cards:
-            card.display()
+        for card in game.cards:
+            display_card(card)
             
         # 入力を受け付ける
         input_str = input("\n*番号を入力してください（終了する場合は'q'を入力）: ").strip()
@@ -125,25 +75,18 @@ def run_interactive_bingo(cards):
             print(f"\n呼ばれた番号: {number}")
             print(f"\nこれまでのビンゴ数: {flag}")
             
-            # 各カードをチェック
-            for card in cards:
-                if card.mark_number(str(number)):
-                    print(f"Card No.{card.card_number}でマークされました！")
-                
-                # ビンゴチェック
-                current_patterns = card.check_bingo()
-                if card.card_number not in bingo_cards:
-                    bingo_cards[card.card_number] = set()
+            # 番号を持つカードだけをチェック（それ以外のカードは新しいビンゴにならない）
+            for card in game.mark_number(number):
+                print(f"Card No.{card.card_number}でマークされました！")
                 
-                # 新しいビンゴパターンをチェック
-                new_patterns = set(current_patterns) - bingo_cards[card.card_number]
+                # 新しいビンゴパターンをチェック（check_bingo は前回から新しく揃ったラインだけを返す）
+                new_patterns = card.check_bingo()
                 if new_patterns:
                     print("\n！！！！！！congratulation！！！！！！")
                     print(f"BINGO! Card No.{card.card_number}で新しいビンゴが発生しました！")
                     flag+=1
                     for pattern in new_patterns:
                         print(f"- {pattern}")
-                    bingo_cards[card.card_number].update(new_patterns)
                     # ビンゴ履歴に追加
                     bingo_history.append((card.card_number, flag))
             
@@ -158,24 +101,106 @@ def run_interactive_bingo(cards):
         print(f"Card No.{card_num} - ビンゴ回数: {count}")
     print("=============================")
 
-# カードの初期化
-card1 = BingoCard(5890, [
-    [13, 22, 42, 49, 61],
-    [6, 21, 38, 57, 64],
-    [2, 16, 0, 55, 66],  # 0は FREE スペース
-    [11, 23, 35, 58, 65],
-    [5, 29, 45, 53, 70]
-])
-
-card2 = BingoCard(4119, [
-    [4, 19, 41, 46, 74],
-    [7, 26, 44, 58, 70],
-    [12, 27, 0, 60, 65],  # 0は FREE スペース
-    [11, 16, 36, 56, 73],
-    [8, 17, 33, 51, 63]
-])
-
-# プログラムを実行
-cards = [card1, card2]
-print("ビンゴゲームを開始します！")
-run_interactive_bingo(cards)
\ No newline at end of file
+def demo_cards():
+    """対話モードで使うサンプルのカード"""
+    card1 = BingoCard(5890, [
+        [13, 22, 42, 49, 61],
+        [6, 21, 38, 57, 64],
+        [2, 16, 0, 55, 66],  # 0は FREE スペース
+        [11, 23, 35, 58, 65],
+        [5, 29, 45, 53, 70]
+    ])
+
+    card2 = BingoCard(4119, [
+        [4, 19, 41, 46, 74],
+        [7, 26, 44, 58, 70],
+        [12, 27, 0, 60, 65],  # 0は FREE スペース
+        [11, 16, 36, 56, 73],
+        [8, 17, 33, 51, 63]
+    ])
+    return [card1, card2]
+
+def load_game(card_file, backend=None):
+    """
+    カードファイルを読み込む
+    :param card_file: save_cards が書き出したJSON（ジャーナルがあれば続きも適用する）、
+                      またはバイナリ形式（.bcard）のファイル
+    :param backend: bingo_engine.engine のバックエンド名。None なら枚数に合わせて選ぶ
+    """
+    # numpy は CardStore を使うときに初めて読み込む（対話モードや少ない枚数なら不要なので）
+    if card_file.endswith('.bcard'):
+        from bingo_engine.binfile import BinaryCardFile
+        return BinaryCardFile(card_file).to_card_store()
+    from bingo_engine.journal import GameJournal
+    data, records = GameJournal(card_file).read()
+    return game_from_dicts(data, backend).replay(records)
+
+def iter_draws(lines):
+    """呼ばれた番号の入力（空白・カンマ・改行区切り）を1つずつ取り出す"""
+    for line in lines:
+        for token in line.replace(',', ' ').split():
+            yield token
+
+def run_replay(card_file, lines, out=sys.stdout, err=sys.stderr, backend=None):
+    """
+    対話なしでビンゴを進める（記録したゲームの再生や抽選機からの入力用）
+    ビンゴが発生するたびに1件1行のJSONを出力する
+        {"draw": 何番目の番号か, "number": 番号, "card": カード番号, "pattern": ビンゴパターン}
+    :param card_file: カードファイル
+    :param lines: 呼ばれた番号の入力（ファイルや標準入力の行）
+    :param backend: bingo_engine.engine のバックエンド名。None なら枚数に合わせて選ぶ
+    :return: 最終状態のゲーム（CardStore または CardGame）
+    """
+    game = load_game(card_file, backend)
+    used_numbers = set()
+    draw = 0
+    for token in iter_draws(lines):
+        try:
+            number = int(token)
+        except ValueError:
+            print(f"スキップ: {token} は数字ではありません", file=err)
+            continue
+        if number < 1 or number > 75:
+            print(f"スキップ: {number} は1から75の範囲外です", file=err)
+            continue
+        if number in used_numbers:
+            print(f"スキップ: {number}は既に呼ばれています", file=err)
+            continue
+        used_numbers.add(number)
+        draw += 1
+
+        results = game.call(number)
+        for card_number, patterns in results:
+            for pattern in patterns:
+                event = {"draw": draw, "number": number, "card": card_number, "pattern": pattern}
+                out.write(json.dumps(event, ensure_ascii=False) + "\n")
+        if results:
+            out.flush()  # パイプの先にすぐ届くように
+    return game
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ビンゴゲームのチェッカー")
+    parser.add_argument("--cards", help="カードファイル（JSONまたは.bcard）。指定すると対話なしで実行する")
+    parser.add_argument("--draws", default="-", help="呼ばれた番号のファイル（省略または - で標準入力）")
+    parser.add_argument("--backend", choices=BACKENDS,
+                        help="カードの持ち方（省略すると枚数に合わせて選ぶ。.bcard は常に array）")
+    args = parser.parse_args(argv)
+
+    if args.cards is None:
+        # プログラムを実行
+        print("ビンゴゲームを開始します！")
+        run_interactive_bingo(demo_cards())
+        return
+    try:
+        if args.draws == "-":
+            run_replay(args.cards, sys.stdin, backend=args.backend)
+        else:
+            with open(args.draws, 'r', encoding='utf-8') as f:
+                run_replay(args.cards, f, backend=args.backend)
+    except BrokenPipeError:
+        # 出力先（head など）が先に閉じた場合は静かに終わる
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
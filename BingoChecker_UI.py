@@ -7,67 +7,26 @@ Renewed on Fri Nov  7 21:00:00 2025　とりあえず、上記の機能を削除
 @author: egumon
 """
 
+from collections import OrderedDict
+
 import streamlit as st
 import pandas as pd
-import json # <--- 追加
-import os   # <--- ファイルの存在チェックのために追加
-
-#DATA_FILE = "bingo_data.json" # 保存ファイル名を定義
 
-class BingoCard:
-    def __init__(self, card_number, numbers):
-        self.card_number = card_number
-        self.numbers = numbers
-        self.marked = [[False for _ in range(5)] for _ in range(5)]
-        self.marked[2][2] = True  # FREE space
-        self.bingo_lines = set()
-
-    def mark_number(self, number):
-        marked = False
-        for i in range(5):
-            for j in range(5):
-                if self.numbers[i][j] == number:
-                    self.marked[i][j] = True
-                    marked = True
-        return marked
-
-    def check_bingo(self):
-        new_bingo_patterns = []
-        
-        # Check rows
-        for i in range(5):
-            line_key = f"row_{i}"
-            if line_key not in self.bingo_lines and all(self.marked[i][j] for j in range(5)):
-                new_bingo_patterns.append(f"横{i+1}行目")
-                self.bingo_lines.add(line_key)
-
-        # Check columns
-        for j in range(5):
-            line_key = f"col_{j}"
-            if line_key not in self.bingo_lines and all(self.marked[i][j] for i in range(5)):
-                new_bingo_patterns.append(f"縦{j+1}列目")
-                self.bingo_lines.add(line_key)
+# カード・ゲームの状態は bingo_engine.game にある（HTTP サービスと共通）
+from bingo_engine.game import BingoCard, load_shared_game, watch_files_for
+from bingo_engine.importer import detect_format, import_cards, validate_numbers
+from bingo_engine.metrics import METRICS
+from bingo_engine.montecarlo import WinProbabilityEstimator
+from bingo_engine.patterns import PATTERNS, card_masks, parse_pattern
+from bingo_engine.reach import card_number_key
+from bingo_engine.registry import GameRegistry
 
-        # Check diagonals
-        if "diagonal1" not in self.bingo_lines and all(self.marked[i][i] for i in range(5)):
-            new_bingo_patterns.append("斜め（左上から右下）")
-            self.bingo_lines.add("diagonal1")
-
-        if "diagonal2" not in self.bingo_lines and all(self.marked[i][4-i] for i in range(5)):
-            new_bingo_patterns.append("斜め（右上から左下）")
-            self.bingo_lines.add("diagonal2")
+#DATA_FILE = "bingo_data.json" # 保存ファイル名を定義
 
-        return new_bingo_patterns
-    
-    def to_dict(self): # <--- 追加: 辞書に変換するメソッド
-        return {
-            "card_number": self.card_number,
-            "numbers": self.numbers,
-            # marked は True/False の二重リストなのでそのまま保存可能
-            "marked": self.marked,
-            # setはJSONにできないのでlistに変換
-            "bingo_lines": list(self.bingo_lines) 
-        }
+# カード一覧の1ページあたりの枚数の選択肢
+PAGE_SIZES = [10, 20, 50, 100]
+# 表のキャッシュに残すページ数（最近表示したカードから残し、古いものから捨てる）
+DISPLAY_CACHE_PAGES = 2
 
 def create_bingo_card_manually():
     st.subheader("ビンゴカードの手動登録")
@@ -106,7 +65,11 @@ def create_bingo_card_manually():
 
     # Create BingoCard object only if all inputs are valid
     if card_number and len(numbers) == 5 and rows_valid:
-        return BingoCard(card_number, numbers)
+        # ファイルからの読み込みと同じ検証をする（1〜75 の範囲外・重複した数字のカードは登録しない）
+        reason = validate_numbers(numbers)
+        if reason is None:
+            return BingoCard(card_number, numbers)
+        st.warning(reason)
     return None
 
 def create_bingo_display(card):
@@ -139,47 +102,143 @@ def create_bingo_display(card):
     
     # 【変更点2】Stylerを適用して背景色を設定
     
-    # マーカー（True/False）のDataFrameを作成
-    marked_df = pd.DataFrame(marked_flags)
-
-    # セルがTrue（マーク済み）の場合に背景色を 'lightgray' に設定する関数
-    def highlight_marked(val):
-        color = 'background-color: lightgray' if val else ''
-        return color
+    # セルがTrue（マーク済み）の場合に背景色を 'lightgray' にしたスタイルのDataFrameを作成
+    style_df = pd.DataFrame(
+        [['background-color: lightgray' if flag else '' for flag in row_flags] for row_flags in marked_flags]
+    )
 
     # Stylerを適用して、マーク済みのセルの背景色を灰色に変更
-    # axis=None で要素ごとに適用
-    styled_df = df.style.apply(
-        lambda x: marked_df.applymap(highlight_marked), # marked_dfを使って色を決定
-        axis=None
-    )
+    # axis=None で表全体に一度に適用
+    styled_df = df.style.apply(lambda x: style_df, axis=None)
     
     return styled_df # スタイルが適用されたDataFrameを返す
 
-def save_cards(cards, data_file): # <-- data_file を引数に追加
-    """ビンゴカードのリストをJSONファイルに保存する"""
-    data_to_save = [card.to_dict() for card in cards]
-    # data_file を使用
-    with open(data_file, 'w', encoding='utf-8') as f:
-        json.dump(data_to_save, f, ensure_ascii=False, indent=4)
-
-def load_cards(data_file): # <-- data_file を引数に追加
-    """JSONファイルからビンゴカードを読み込む"""
-    # data_file を使用
-    if not os.path.exists(data_file):
-        return []
-        
-    with open(data_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-        cards = []
-        for d in data:
-            # 辞書からBingoCardオブジェクトを再構築 (ここは変更なし)
-            card = BingoCard(d['card_number'], d['numbers'])
-            card.marked = d['marked']
-            card.bingo_lines = set(d['bingo_lines']) # setに戻す
-            cards.append(card)
-        return cards
+def cached_bingo_display(card):
+    """
+    create_bingo_display の結果をカード番号ごとにキャッシュする
+    マーク状態が変わったカード（mark_version が変わったもの）だけを作り直す
+    """
+    cache = st.session_state.setdefault('display_cache', OrderedDict())
+    hit = cache.get(card.card_number)
+    if hit is None or hit[0] != card.mark_version:
+        hit = cache[card.card_number] = (card.mark_version, create_bingo_display(card))
+    cache.move_to_end(card.card_number)
+    return hit[1]
+
+def prune_display_cache(limit):
+    """表のキャッシュを最近使った limit 枚分だけ残す（ページをめくっても増え続けないように）"""
+    cache = st.session_state.get('display_cache')
+    while cache and len(cache) > limit:
+        cache.popitem(last=False)
+
+def get_win_estimator(cards, used_numbers, samples):
+    """
+    セッションごとの勝率推定を取り出す
+    カードの構成やサンプル数が変わったとき、番号が取り消されたとき（差分で反映できない）だけ作り直し、
+    それ以外は新しく呼ばれた番号の差分だけ反映する
+    """
+    estimator = st.session_state.get('win_estimator')
+    card_numbers = [card.card_number for card in cards]
+    used = set(used_numbers)
+    retracted = st.session_state.get('win_estimator_used', set()) - used
+    if estimator is None or estimator.samples != samples or estimator.card_numbers != card_numbers or retracted:
+        estimator = WinProbabilityEstimator.from_cards(cards, used_numbers, samples=samples)
+        st.session_state.win_estimator = estimator
+    else:
+        for number in sorted(used - estimator.called):
+            estimator.call(number)
+    st.session_state.win_estimator_used = used
+    return estimator
+
+def filter_cards(cards, mode, query="", reach_cards=()):
+    """
+    カード一覧の絞り込み
+    :param mode: "all" / "bingo"（ビンゴ済み） / "reach"（あと1つ）
+    :param query: カード番号の部分一致検索
+    :param reach_cards: リーチのカード番号の集合（"reach" のときだけ使う。ReachBoard の写し）
+    """
+    if mode == "reach":
+        cards = [card for card in cards if card.card_number in reach_cards]
+    if query:
+        cards = [card for card in cards if query in str(card.card_number)]
+    if mode == "bingo":
+        cards = [card for card in cards if card.bingo_lines]
+    return cards
+
+def take_snapshot(game):
+    """
+    この回の表示に使うゲームの状態を、ロックを一度だけ取って写しておく
+    他のセッションが途中でカードの登録・削除や番号の呼び出しをしても、表示の中で食い違わない
+    """
+    with game.lock:
+        cards = list(game.cards)
+        st.session_state.cards = cards
+        st.session_state.used_numbers = list(game.called)
+        st.session_state.bingo_card_numbers = [card.card_number for card in cards if card.bingo_lines]
+        # 特別な形の判定用（カード番号と同じ並び）
+        st.session_state.card_masks = card_masks(cards) if game.patterns else None
+
+@st.cache_resource
+def get_game_registry():
+    """プロセス全体で1つのゲームレジストリ（全セッションで共有される）"""
+    return GameRegistry(load_shared_game, watch_files=watch_files_for)
         
+def show_history_state(history, draw):
+    """draw 回目の直後の状態（呼ばれていた番号・ビンゴのカード）を表示する"""
+    cache_key = (st.session_state.access_id, draw, len(history.records))
+    cached = st.session_state.get("history_state")
+    if cached is None or cached[0] != cache_key:
+        store, called = history.state_at(draw)
+        cached = st.session_state.history_state = (cache_key, called, store.check_bingo())
+    _, called, bingo_at = cached
+    st.write(f"{draw} 回目の直後: 呼ばれていた番号 {len(called)} 個、ビンゴのカード {len(bingo_at)} 枚")
+    st.markdown(f"`{', '.join(map(str, called))}`")
+    if bingo_at:
+        st.dataframe(
+            pd.DataFrame(
+                [(str(card_number), ", ".join(patterns)) for card_number, patterns in bingo_at],
+                columns=["カード番号", "ビンゴライン"],
+            ),
+            use_container_width=True, hide_index=True,
+        )
+
+def toggle_metrics():
+    """計測のオン/オフを切り替えたセッションだけが METRICS.enabled を書き換える（再描画の前に呼ばれる）"""
+    METRICS.enabled = st.session_state.metrics_enabled
+
+def show_metrics_panel():
+    """
+    サイドバーの処理時間パネル（読み込み・マーク・判定・保存・描画）
+    計測はプロセス全体で共有され、オフのあいだは記録しない
+    """
+    with st.sidebar:
+        # トグルはセッションごとの値を持たせず、毎回プロセス全体の設定を映す（他のセッションの切り替えを上書きしない）
+        st.session_state.metrics_enabled = METRICS.enabled
+        st.toggle("⏱️ 処理時間を計測する", key="metrics_enabled", on_change=toggle_metrics)
+        if not METRICS.enabled:
+            return
+        summary = METRICS.summary()
+        if not summary:
+            st.caption("まだ記録がありません")
+            return
+        st.dataframe(
+            pd.DataFrame(
+                [(s["name"], s["count"], f"{s['total_s']:.3f}", f"{s['p50_s'] * 1000:.1f}",
+                  f"{s['p95_s'] * 1000:.1f}", f"{s['max_s'] * 1000:.1f}", f"{s['cards_per_call']:.1f}")
+                 for s in summary],
+                columns=["処理", "回数", "合計(秒)", "p50(ms)", "p95(ms)", "最大(ms)", "枚数/回"],
+            ),
+            use_container_width=True, hide_index=True,
+        )
+        col_json, col_csv = st.columns(2)
+        with col_json:
+            st.download_button("JSON", METRICS.to_json(), file_name="bingo_metrics.json", mime="application/json")
+        with col_csv:
+            st.download_button("CSV", METRICS.to_csv(), file_name="bingo_metrics.csv", mime="text/csv")
+        if st.button("記録をリセット", key="metrics_reset"):
+            METRICS.reset()
+            st.rerun()
+
 def main():
     # layout Setting
     st.set_page_config(layout="wide")
@@ -213,18 +272,19 @@ def main():
             # 既に上のコンテナで警告を表示しているので、returnで中断
             return
     
-    # ユーザー固有のデータファイルパスを定義
-    # 例: "bingo_data_userA.json", "bingo_data_userB.json" のように分かれる
-    USER_DATA_FILE = f"bingo_data_{st.session_state.access_id}.json"
-
-
     # Initialize session state
-    if 'cards' not in st.session_state:
-        # 【修正】定義したユーザー固有のファイルパスを渡してロード
-        st.session_state.cards = load_cards(USER_DATA_FILE)
+    # 同じアクセスIDのゲームはプロセス内で1つだけ読み込み、全セッションで共有する
+    registry = get_game_registry()
+    lease = st.session_state.get('game_lease')
+    if lease is None or lease.access_id != st.session_state.access_id:
+        st.session_state.game_lease = registry.lease(st.session_state.access_id)
+    game = st.session_state.game_lease.game
+    # 番号 → カード位置のインデックス（カードの読み込み時に構築し、登録/削除で更新）
+    st.session_state.number_index = game.number_index
     
-    if 'used_numbers' not in st.session_state:
-        st.session_state.used_numbers = set()
+    # 呼ばれた番号はアクセスIDごとに履歴ファイルへ保存され、全端末で共有される（呼ばれた順のリスト）
+    # 読み込み直しや別の端末からでも、そのまま今の回から続けられる
+    take_snapshot(game)
 
     # 【新規追加】登録モードの状態管理
     if 'registration_mode' not in st.session_state:
@@ -267,12 +327,13 @@ def main():
         # 【修正】ボタン名を「このカードを登録」に変更
         if st.button("💾 このカードを登録", type="primary", key="register_card_submit"): # キーを追加
             if new_card is not None:
-                if any(card.card_number == new_card.card_number for card in st.session_state.cards):
+                # 他の端末の登録に追いついてから重複をチェックして登録する
+                try:
+                    game.add_cards([new_card.card_number], [new_card.numbers])
+                except ValueError:
                     st.warning("このカード番号は既に登録されています")
                 else:
-                    st.session_state.cards.append(new_card)
-                    save_cards(st.session_state.cards, USER_DATA_FILE)
-
+                    registry.note_write(st.session_state.access_id)
                     # 登録成功メッセージ用のキーを設定
                     st.session_state.last_registered_card = new_card.card_number
                     
@@ -281,6 +342,39 @@ def main():
             else:
                 st.error("全ての入力フィールドを正しく入力してください")
 
+        # ファイルからの一括登録
+        with st.expander("📂 **ファイルから一括登録（CSV / JSON Lines / JSON）**"):
+            st.caption(
+                "CSV: 1行1枚で「カード番号,数字25個（左上から横方向、真ん中は0）」 / "
+                "JSON Lines: 1行1枚で {\"card_number\": ..., \"numbers\": 5x5の数字リスト} / "
+                "JSON: 同じ形の辞書の配列（保存された bingo_data_{アクセスID}.json もそのまま読めます）"
+            )
+            uploaded = st.file_uploader("カードのファイルを選択", type=["csv", "jsonl", "ndjson", "json"], key="bulk_upload")
+            if uploaded is not None and st.button("📥 ファイルのカードを一括登録", key="bulk_register_submit"):
+                with game.transaction():
+                    report = import_cards(uploaded, detect_format(uploaded.name),
+                                          existing=st.session_state.number_index.cards_by_number,
+                                          grids=st.session_state.number_index.grids)
+                    # import_cards が登録済み・ファイル内で重複したカード番号を除いているので ValueError にはならない
+                    new_cards = game.add_cards([card_number for card_number, _ in report.cards],
+                                               [numbers for _, numbers in report.cards])
+                if new_cards:
+                    registry.note_write(st.session_state.access_id)
+                    take_snapshot(game)  # 再描画せずに一覧まで表示するので、登録したカードも写しに入れる
+                st.success(f"🎉 {len(new_cards)} 枚のカードを登録しました")
+                if report.rejected:
+                    st.warning(f"{len(report.rejected)} 行は登録できませんでした")
+                    st.dataframe(
+                        pd.DataFrame(report.rejected, columns=["行", "カード番号", "理由"]),
+                        use_container_width=True, hide_index=True,
+                    )
+                if report.duplicates:
+                    st.info(f"{len(report.duplicates)} 枚は登録済み（またはファイル内）のカードと同じ数字です（判定は1回にまとめます）")
+                    st.dataframe(
+                        pd.DataFrame(report.duplicates, columns=["行", "カード番号", "同じ数字のカード番号"]),
+                        use_container_width=True, hide_index=True,
+                    )
+
         st.markdown("---")
         
         # 登録成功メッセージとリセットボタンの設置
@@ -288,6 +382,12 @@ def main():
             card_num = st.session_state.last_registered_card
             # 【修正】メッセージを「登録できました！」に変更
             st.success(f"🎉 **カード No.{card_num}** を登録できました！")
+            registered = st.session_state.number_index.cards_by_number.get(card_num)
+            if registered is not None:
+                twins = [card.card_number for card in st.session_state.number_index.same_grid(registered.numbers)
+                         if card is not registered]
+                if twins:
+                    st.warning(f"カード No.{', '.join(map(str, twins))} と同じ数字のカードです")
             # 【新規追加】次の操作手順の説明
             st.info(
                 "次のカードを登録するには、一度 **「🎯 番号マーク」** ボタンを押し、"
@@ -295,6 +395,40 @@ def main():
                 "入力フォームを自動でクリアする機能の実装が間に合わなかった💦ゴメンネ、、、"
             )
             
+    # 特別な形（スペシャルラウンド）の選択。選んだ形はこのアクセスIDの全端末で共有される
+    if not st.session_state.registration_mode:
+        with st.expander("🧩 **特別な形（スペシャルラウンド）**"):
+            with game.lock:
+                pattern_labels = {key: p.label for key, p in {**PATTERNS, **game.custom_patterns}.items()}
+                selected = [p.key for p in game.patterns.patterns]
+            if st.session_state.get('special_patterns') != selected:
+                st.session_state.special_patterns = selected  # 他の端末で選び直された場合に合わせる
+
+            def select_patterns():
+                game.set_patterns(st.session_state.special_patterns)
+                registry.note_write(st.session_state.access_id)
+
+            st.multiselect("判定する形", list(pattern_labels), format_func=pattern_labels.get, key="special_patterns",
+                           on_change=select_patterns)
+            col_name, col_art = st.columns([1, 2])
+            with col_name:
+                custom_label = st.text_input("自作の形の名前", key="custom_pattern_label").strip()
+            with col_art:
+                custom_art = st.text_area("形（5行 x 5文字、#=必要なマス、.=不要なマス）",
+                                          value="#...#\n.#.#.\n..#..\n.#.#.\n#...#", key="custom_pattern_art")
+            if st.button("➕ 自作の形を追加", key="custom_pattern_submit"):
+                try:
+                    pattern = parse_pattern(f"custom_{custom_label}", custom_label, custom_art)
+                except ValueError as e:
+                    st.error(str(e))
+                else:
+                    if not custom_label:
+                        st.error("形の名前を入力してください")
+                    else:
+                        game.add_custom_pattern(pattern)
+                        registry.note_write(st.session_state.access_id)
+                        st.rerun()
+
     # Display called numbers
     if not st.session_state.registration_mode: # 【条件追加】ビンゴモードのみ表示
         st.subheader("🎯 今、呼ばれた番号")
@@ -303,59 +437,168 @@ def main():
             number = st.number_input("🔢 **番号を入力してください** (1-75):", min_value=1, max_value=75, step=1, key="called_number_input")
         with col2:
             if st.button("✅ マークする", type="primary"):
-                if number in st.session_state.used_numbers:
+                # インデックスから番号を持つカードだけを取り出してマーク・判定・保存する
+                # （他の端末が既に呼んでいた番号なら None が返る）
+                result = None if number in st.session_state.used_numbers else game.play(number)
+                if result is None:
                     st.warning(f"番号 {number} は既に使用されています")
                 else:
-                    st.session_state.used_numbers.add(number)
-                    
-                    # マーク/ビンゴ判定後にカードデータを保存する必要があるかチェック
-                    data_changed = False
-                    for card in st.session_state.cards:
-                        if card.mark_number(number):
-                            data_changed = True # マークされたらデータ変更フラグを立てる
-                            st.success(f"Card No.{card.card_number}でマークされました！")
+                    touched, bingos, pattern_results = result
+                    registry.note_write(st.session_state.access_id)
+                    take_snapshot(game)  # 再描画せずに下の一覧まで表示するので、この番号の結果も写しに入れる
+                    bingos = dict((card.card_number, patterns) for card, patterns in bingos)
+                    for card in touched:
+                        st.success(f"Card No.{card.card_number}でマークされました！")
                         
-                        patterns = card.check_bingo()
+                        patterns = bingos.get(card.card_number)
                         if patterns:
-                            data_changed = True # ビンゴが発生してもデータ変更フラグを立てる
-                            
                             st.balloons()
                             st.success(f"BINGO! Card No.{card.card_number}で新しいビンゴが発生しました！")
                             for pattern in patterns:
                                 st.write(f"- {pattern}")
                       # --- [END] for ループ ---
-                    
-                    # ★ データが変更された場合、ファイルを保存 (ループの外で一度だけ呼び出す)
-                    if data_changed: 
-                        save_cards(st.session_state.cards, USER_DATA_FILE)
+                    for card, labels in pattern_results:
+                        st.balloons()
+                        st.success(f"SPECIAL! Card No.{card.card_number}で「{'」「'.join(labels)}」が揃いました！")
 
     # Display used numbers
     if not st.session_state.registration_mode: # 【追加】ビンゴモードのみ表示
         st.subheader("🗒️ **これまでに呼ばれた番号**")
         used_numbers_str = ", ".join(map(str, sorted(list(st.session_state.used_numbers))))
         st.markdown(f"`{used_numbers_str}`")
+
+        # 間違えて入力した番号の取り消し（その番号を持つカードだけマークを外す）
+        if st.session_state.used_numbers:
+            col_retract, col_retract_btn = st.columns([1, 5])
+            with col_retract:
+                retract_number = st.selectbox("↩️ 取り消す番号", sorted(st.session_state.used_numbers), key="retract_number")
+            with col_retract_btn:
+                st.markdown("<br>", unsafe_allow_html=True)
+                if st.button("↩️ この番号を取り消す", key="retract_submit"):
+                    touched = game.retract(retract_number)
+                    registry.note_write(st.session_state.access_id)
+                    st.session_state.last_retracted = (retract_number, len(touched))
+                    st.rerun()
+        if 'last_retracted' in st.session_state:
+            retracted, touched_count = st.session_state.pop('last_retracted')
+            st.info(f"番号 {retracted} を取り消しました（{touched_count} 枚のカードのマークを外しました）")
         
+        # 呼ばれた順の履歴と、途中の回の状態の作り直し（あとから確認するため）
+        history = game.history
+        if history is not None and history.draws:
+            with st.expander("🕒 **呼ばれた順の履歴**"):
+                st.dataframe(
+                    pd.DataFrame(
+                        [(record['draw'], record['number'], record['time'],
+                          ", ".join(str(win['card_number']) for win in record['winners']))
+                         for record in history.calls()],
+                        columns=["回", "番号", "時刻", "ビンゴになったカード"],
+                    ),
+                    use_container_width=True, hide_index=True,
+                )
+                # 途中の状態はカードの枚数に比例して重いので、見るときだけ作り、履歴が増えるまで使い回す
+                if st.toggle("途中の回の直後の状態を見る", key="history_show_state"):
+                    draw = st.number_input("何回目の直後の状態を見るか", min_value=1, max_value=history.draws,
+                                           value=history.draws, key="history_draw")
+                    show_history_state(history, draw)
+
         # Display Bingo'd card numbers
         st.subheader("👑 **BINGOになったカード番号**")
-        bingo_card_numbers = [card.card_number for card in st.session_state.cards if card.bingo_lines]
-        bingo_card_numbers_str = ", ".join(map(str, sorted(bingo_card_numbers)))
+        bingo_card_numbers_str = ", ".join(map(str, sorted(st.session_state.bingo_card_numbers, key=card_number_key)))
         st.markdown(f"`{bingo_card_numbers_str}`")
+
+        # 特別な形が揃っているカード（選ばれた形を全カードに対して一度にまとめて判定）
+        if st.session_state.card_masks is not None:
+            st.subheader("🧩 **特別な形が揃ったカード**")
+            winners = game.patterns.winners(st.session_state.card_masks,
+                                            [card.card_number for card in st.session_state.cards])
+            if winners:
+                st.dataframe(
+                    pd.DataFrame(
+                        [(label, len(card_numbers), ", ".join(map(str, card_numbers))) for label, card_numbers in winners],
+                        columns=["形", "枚数", "カード番号"],
+                    ),
+                    use_container_width=True, hide_index=True,
+                )
+            else:
+                st.markdown("`まだありません`")
+
+        # リーチのカードと、出ればビンゴになる番号（マークのたびに差分で更新されている）
+        # ReachBoard は他のセッションが番号を呼ぶと書き換わるので、ロックの中で写しを取ってから表示する
+        reach = st.session_state.number_index.reach
+        with game.lock:
+            reach_cards = sorted(reach.reach_cards(), key=card_number_key)
+            numbers_to_win = reach.numbers_to_win()
+        st.subheader(f"📣 **リーチのカード番号**（{len(reach_cards)} 枚）")
+        st.markdown(f"`{', '.join(map(str, reach_cards))}`")
+        if numbers_to_win:
+            st.write("この番号が出ればビンゴ:")
+            st.dataframe(
+                pd.DataFrame(
+                    [(number, len(cards), ", ".join(map(str, cards))) for number, cards in numbers_to_win],
+                    columns=["番号", "ビンゴになる枚数", "カード番号"],
+                ),
+                use_container_width=True, hide_index=True,
+            )
+
+        # 次にビンゴになりそうなカード（残りの番号の出る順番をサンプリングして推定）
+        st.subheader("🔮 **次にビンゴになりそうなカード**")
+        if st.toggle("勝率を計算する", key="show_win_probability") and st.session_state.cards:
+            col_k, col_samples = st.columns(2)
+            with col_k:
+                within = st.slider("あと何回以内にビンゴになるか", min_value=1, max_value=20, value=5, key="win_within")
+            with col_samples:
+                samples = st.select_slider("サンプル数", options=[500, 1000, 2000, 5000], value=2000, key="win_samples")
+            estimator = get_win_estimator(st.session_state.cards, st.session_state.used_numbers, samples)
+            ranking = estimator.ranking(within, top=10)
+            st.dataframe(
+                pd.DataFrame(
+                    [(str(card_number), f"{probability:.1%}", f"{expected:.1f}") for card_number, probability, expected in ranking],
+                    columns=["カード番号", f"{within}回以内にビンゴになる確率", "ビンゴまでの回数（期待値）"],
+                ),
+                use_container_width=True, hide_index=True,
+            )
     
     # Display cards
     st.subheader("📋 **ビンゴカード一覧**")
-    for i, card in enumerate(st.session_state.cards):
-        st.write(f"Card No.{card.card_number}")
-        # スタイル付きDataFrameをそのまま渡す
-        st.dataframe(create_bingo_display(card), use_container_width=True)
-        if card.bingo_lines:
-            st.write("ビンゴライン:", list(card.bingo_lines))
-        if st.button(f"カード No.{card.card_number}を削除", key=f"delete_{i}"):
-            removed_card_number = st.session_state.cards[i].card_number
-            st.session_state.cards.pop(i)
-            # 修正: USER_DATA_FILE を引数に追加
-            save_cards(st.session_state.cards, USER_DATA_FILE)
-            st.success(f"カード No.{removed_card_number} を削除しました")
-            st.rerun() # 削除後に即座に表示を更新するためリロード
+    # 絞り込みとページ分け（カードが多くても表示するのは1ページ分だけ）
+    col_filter, col_search, col_size, col_page = st.columns([2, 2, 1, 1])
+    with col_filter:
+        filter_labels = {"all": "すべて", "bingo": "ビンゴのみ", "reach": "リーチ（あと1つ）"}
+        filter_mode = st.radio("表示するカード", list(filter_labels), format_func=filter_labels.get,
+                               horizontal=True, key="card_filter")
+    with col_search:
+        query = st.text_input("🔍 カード番号で検索", key="card_search").strip()
+    with col_size:
+        page_size = st.selectbox("1ページの枚数", PAGE_SIZES, index=1, key="card_page_size")
+    reach_cards = set()
+    if filter_mode == "reach":
+        with game.lock:
+            reach_cards = set(st.session_state.number_index.reach.reach_cards())
+    shown_cards = filter_cards(st.session_state.cards, filter_mode, query, reach_cards)
+    page_count = max(1, -(-len(shown_cards) // page_size))
+    with col_page:
+        page = st.number_input("ページ", min_value=1, max_value=page_count, step=1, key="card_page")
+    st.caption(f"{len(shown_cards)} 枚中 {min(len(shown_cards), (page - 1) * page_size + 1)}〜"
+               f"{min(len(shown_cards), page * page_size)} 枚目を表示（全 {page_count} ページ）")
+
+    page_cards = shown_cards[(page - 1) * page_size:page * page_size]
+    with METRICS.measure("render", len(page_cards)):
+        for card in page_cards:
+            st.write(f"Card No.{card.card_number}")
+            # スタイル付きDataFrameをそのまま渡す（マーク状態が変わったカードだけ作り直す）
+            st.dataframe(cached_bingo_display(card), use_container_width=True)
+            if card.bingo_lines:
+                st.write("ビンゴライン:", list(card.bingo_lines))
+            if st.button(f"カード No.{card.card_number}を削除", key=f"delete_{card.card_number}"):
+                removed_card_number = card.card_number
+                game.delete_card(removed_card_number)
+                registry.note_write(st.session_state.access_id)
+                st.success(f"カード No.{removed_card_number} を削除しました")
+                st.rerun() # 削除後に即座に表示を更新するためリロード
+    prune_display_cache(DISPLAY_CACHE_PAGES * page_size)
+
+    show_metrics_panel()
     
     st.write("©egumon2022 2025/11/7 version_2025最新ver", unsafe_allow_html=True)
 
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+ビンゴ判定のベンチマーク
+ランダムに作った正しいカード（B 1-15, I 16-30, N 31-45, G 46-60, O 61-75）を使い、
+カード枚数ごとに次の時間を測って、結果をJSONで出力する
+
+    mark_check   ... 1回の番号のマーク + ビンゴ判定の時間（平均・最大）
+    full_game    ... 75個すべての番号を呼ぶまでの時間とスループット
+    json_save / json_load ... save_cards / load_cards の時間とファイルサイズ
+    render       ... create_bingo_display（DataFrame + Styler）の1枚あたりの時間
+
+使い方:
+    python benchmarks/bench_bingo.py                       # 10^2, 10^4, 10^6 枚
+    python benchmarks/bench_bingo.py --scales 100 1000 --out result.json
+    python benchmarks/bench_bingo.py --compare old.json    # 以前の結果との比較も表示
+
+@author: egumon
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+warnings.filterwarnings("ignore")  # streamlit を UI なしで読み込んだときの警告
+
+from BingoChecker_UI import create_bingo_display  # noqa: E402
+from bingo_engine.game import BingoCard, CompactBingoCard, NumberIndex, load_cards, save_cards  # noqa: E402
+from bingo_engine.store import CardStore  # noqa: E402
+
+SCALES = [100, 10_000, 1_000_000]
+
+
+def generate_numbers(count, rng):
+    """(count, 5, 5) のランダムな正しいカードを作る（列ごとに範囲内から重複なしで5個、真ん中は0）"""
+    numbers = np.empty((count, 5, 5), dtype=np.uint8)
+    for col in range(5):
+        order = np.argsort(rng.random((count, 15)), axis=1)[:, :5]
+        numbers[:, :, col] = order + 1 + 15 * col
+    numbers[:, 2, 2] = 0
+    return numbers
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def _record(results, scale, backend, metric, value, unit):
+    results.append({"scale": scale, "backend": backend, "metric": metric, "value": value, "unit": unit})
+    print(f"  {scale:>9} {backend:<14} {metric:<22} {value:>14.6g} {unit}", file=sys.stderr)
+
+
+def _object_game(cards):
+    """BingoCard / CompactBingoCard のリストで UI と同じ流れ（インデックスでマーク → 判定）を作る"""
+    index = NumberIndex(cards)
+
+    def call(number):
+        for card in index.mark_number(number):
+            card.check_bingo()
+    return call
+
+
+def _store_game(store):
+    return store.call
+
+
+def bench_game(results, scale, backend, make_call, draws):
+    """1回あたりのマーク+判定と、75個呼び終わるまでの全体を測る"""
+    elapsed, call = _timed(make_call)
+    _record(results, scale, backend, "setup", elapsed, "s")
+    latencies = []
+    for number in draws:
+        start = time.perf_counter()
+        call(int(number))
+        latencies.append(time.perf_counter() - start)
+    total = sum(latencies)
+    _record(results, scale, backend, "mark_check_mean", total / len(draws), "s/call")
+    _record(results, scale, backend, "mark_check_p95", float(np.percentile(latencies, 95)), "s/call")
+    _record(results, scale, backend, "mark_check_max", max(latencies), "s/call")
+    _record(results, scale, backend, "full_game", total, "s")
+    _record(results, scale, backend, "full_game_throughput", scale * len(draws) / total, "card-calls/s")
+
+
+def bench_json(results, scale, cards):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bingo_data_bench.json")
+        elapsed, _ = _timed(save_cards, cards, path)
+        _record(results, scale, "json", "json_save", elapsed, "s")
+        _record(results, scale, "json", "json_file_size", os.path.getsize(path), "bytes")
+        elapsed, _ = _timed(load_cards, path, False)
+        _record(results, scale, "json", "json_load", elapsed, "s")
+        elapsed, _ = _timed(load_cards, path, True)
+        _record(results, scale, "json", "json_load_compact", elapsed, "s")
+
+
+def bench_render(results, scale, cards, sample):
+    sample_cards = cards[:sample]
+    start = time.perf_counter()
+    for card in sample_cards:
+        create_bingo_display(card).to_html()  # Styler は描画するときにスタイルを計算するので HTML まで作る
+    per_card = (time.perf_counter() - start) / len(sample_cards)
+    _record(results, scale, "pandas", "render_per_card", per_card, "s/card")
+    _record(results, scale, "pandas", "render_all_projected", per_card * scale, "s")
+
+
+def run(scales, seed, max_object_cards, max_json_cards, render_sample):
+    rng = np.random.default_rng(seed)
+    results = []
+    for scale in scales:
+        print(f"[{scale} 枚]", file=sys.stderr)
+        numbers = generate_numbers(scale, rng)
+        draws = rng.permutation(np.arange(1, 76))
+        card_numbers = [str(i) for i in range(scale)]
+
+        bench_game(results, scale, "card_store", lambda: _store_game(CardStore(card_numbers, numbers)), draws)
+        if scale > max_object_cards:
+            print(f"  {scale} 枚はカードオブジェクトでは測りません（--max-object-cards）", file=sys.stderr)
+            continue
+        number_lists = numbers.tolist()
+        for backend, card_class in (("bingo_card", BingoCard), ("compact_card", CompactBingoCard)):
+            bench_game(results, scale, backend,
+                       lambda: _object_game([card_class(c, n) for c, n in zip(card_numbers, number_lists)]), draws)
+
+        cards = [BingoCard(c, n) for c, n in zip(card_numbers, number_lists)]
+        for number in draws[:30]:
+            for card in cards:
+                card.mark_number(int(number))
+        if scale <= max_json_cards:
+            bench_json(results, scale, cards)
+        bench_render(results, scale, cards, min(scale, render_sample))
+    return results
+
+
+def metadata(args):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "scales": args.scales,
+    }
+
+
+def compare(results, baseline_file):
+    """以前の結果と比べた倍率を表示する（1より大きければ遅くなった）"""
+    with open(baseline_file, "r", encoding="utf-8") as f:
+        baseline = {(r["scale"], r["backend"], r["metric"]): r["value"] for r in json.load(f)["results"]}
+    print("\n比較（今回 / 以前）:", file=sys.stderr)
+    for r in results:
+        old = baseline.get((r["scale"], r["backend"], r["metric"]))
+        if old:
+            print(f"  {r['scale']:>9} {r['backend']:<14} {r['metric']:<22} {r['value'] / old:>8.2f}x", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ビンゴ判定のベンチマーク")
+    parser.add_argument("--scales", type=int, nargs="+", default=SCALES, help="カード枚数")
+    parser.add_argument("--seed", type=int, default=0, help="乱数の種")
+    parser.add_argument("--max-object-cards", type=int, default=100_000,
+                        help="カードオブジェクト（BingoCard など）で測る最大枚数")
+    parser.add_argument("--max-json-cards", type=int, default=100_000, help="JSONの保存・読み込みを測る最大枚数")
+    parser.add_argument("--render-sample", type=int, default=50, help="描画時間を測る枚数")
+    parser.add_argument("--out", help="結果のJSONの出力先（省略時は標準出力）")
+    parser.add_argument("--compare", help="比較する以前の結果のJSON")
+    args = parser.parse_args(argv)
+
+    results = run(args.scales, args.seed, args.max_object_cards, args.max_json_cards, args.render_sample)
+    report = {"meta": metadata(args), "results": results}
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    else:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
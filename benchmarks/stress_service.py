@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+HTTP サービス（BingoService）の同時アクセスの確認
+一時ディレクトリに同じアクセスIDのゲームを作り、次のスレッドを同時に動かす
+
+    抽選機   ... 番号を呼んでは取り消す（POST / DELETE /calls と同じ処理）
+    表示ボード ... /winners・/reach・状態を読み続ける
+    別の書き手 ... 別のレジストリ（画面や別のプロセスの代わり）から番号を呼び、
+                  サービス側のレジストリに差分の取り込み（sync）をさせる
+    SSE     ... 履歴から配信するイベントを読み続ける
+
+決められた時間のうちにすべてのスレッドが終わらなければ（ロックの待ち合わせで止まった）、
+全スレッドのスタックを表示して終了コード 1 で終わる
+
+使い方:
+    python benchmarks/stress_service.py
+    python benchmarks/stress_service.py --cards 2000 --seconds 10
+
+@author: egumon
+"""
+
+import argparse
+import faulthandler
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bingo_engine.game import load_shared_game, watch_files_for  # noqa: E402
+from bingo_engine.registry import GameRegistry  # noqa: E402
+from bingo_engine.server import BingoService, HTTPError  # noqa: E402
+
+ACCESS_ID = "stress"
+
+
+def random_grid(rng):
+    """正しいカード（列ごとに範囲内から重複なしで5個、真ん中は0）"""
+    columns = [rng.sample(range(col * 15 + 1, col * 15 + 16), 5) for col in range(5)]
+    numbers = [[columns[j][i] for j in range(5)] for i in range(5)]
+    numbers[2][2] = 0
+    return numbers
+
+
+def run(cards, seconds, timeout):
+    rng = random.Random(0)
+    service = BingoService()
+    other = GameRegistry(load_shared_game, watch_files=watch_files_for)
+    service.registry.get(ACCESS_ID).add_cards([str(n) for n in range(cards)], [random_grid(rng) for _ in range(cards)])
+    service.registry.note_write(ACCESS_ID)
+
+    deadline = time.monotonic() + seconds
+    errors = []
+
+    def loop(step):
+        def body():
+            local = random.Random(threading.get_ident())
+            try:
+                while time.monotonic() < deadline:
+                    step(local)
+            except Exception as e:  # 止まらずに例外で終わったスレッドも失敗として数える
+                errors.append(f"{threading.current_thread().name}: {type(e).__name__}: {e}")
+        return body
+
+    def draw_machine(local):
+        number = local.randint(1, 75)
+        service.call(ACCESS_ID, [number])
+        try:
+            service.retract(ACCESS_ID, number)
+        except HTTPError:
+            pass  # 他のスレッドが先に取り消した
+
+    def display_board(local):
+        service.winners(ACCESS_ID)
+        service.reach(ACCESS_ID)
+        service.state(ACCESS_ID)
+
+    def other_writer(local):
+        game = other.get(ACCESS_ID)
+        number = local.randint(1, 75)
+        if game.play(number) is not None:
+            other.note_write(ACCESS_ID)
+        time.sleep(0.01)
+
+    def follower(local):
+        service.history_events(ACCESS_ID)
+        time.sleep(0.01)
+
+    threads = [
+        threading.Thread(target=loop(step), name=name, daemon=True)
+        for name, step in [("draw-1", draw_machine), ("draw-2", draw_machine), ("board-1", display_board),
+                           ("board-2", display_board), ("other", other_writer), ("sse", follower)]
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(max(0.0, deadline + timeout - time.monotonic()))
+    stuck = [thread.name for thread in threads if thread.is_alive()]
+    if stuck:
+        print(f"止まったスレッド: {', '.join(stuck)}", flush=True)
+        faulthandler.dump_traceback(all_threads=True)
+        return 1
+    for error in errors:
+        print(error)
+    print(f"OK: {cards} 枚, {seconds} 秒" if not errors else "例外で終わったスレッドがあります")
+    return 1 if errors else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP サービスの同時アクセスの確認")
+    parser.add_argument("--cards", type=int, default=2000, help="カードの枚数")
+    parser.add_argument("--seconds", type=float, default=10, help="動かし続ける時間（秒）")
+    parser.add_argument("--timeout", type=float, default=30, help="終わるのを待つ時間（秒）")
+    args = parser.parse_args(argv)
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        os.chdir(tmp)  # ゲームのファイルはカレントディレクトリに作られる
+        try:
+            code = run(args.cards, args.seconds, args.timeout)
+        finally:
+            os.chdir(cwd)
+    # 止まったスレッドが残っていても終われるように、後片付けを待たずに終了する
+    sys.stdout.flush()
+    os._exit(code)
+
+
+if __name__ == "__main__":
+    main()
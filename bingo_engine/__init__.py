@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""
+ビンゴ判定エンジン
+カードの持ち方は bingo_engine.engine の3つのバックエンド（python / compact / array）から枚数に合わせて選ぶ
+numpy を使うもの（CardStore など）は最初に使われたときに読み込むので、
+CLI の対話モードなど少ない枚数だけを扱う処理では numpy・pandas・streamlit を読み込まない
+
+@author: egumon
+"""
+
+import importlib
+
+from bingo_engine.lines import LINES, LINE_KEYS, LINE_LABELS, LINE_MASKS, FREE_MASK
+from bingo_engine.game import BingoCard, CardGame, CompactBingoCard, NumberIndex, SharedGame
+from bingo_engine.engine import BACKENDS, game_from_dicts, new_game, select_backend
+
+# 名前 -> 読み込むモジュール（numpy を使うもの）
+_LAZY = {
+    "CardStore": "bingo_engine.store",
+    "WinProbabilityEstimator": "bingo_engine.montecarlo",
+}
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        value = getattr(importlib.import_module(_LAZY[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+メモリマップで開けるバイナリ形式のカードファイル
+大量のカードをJSONをパースせずに読み込むための形式で、
+np.memmap で開くとページを複数プロセスで共有したまま使える
+
+ファイルの構成（リトルエンディアン）:
+    ヘッダー 16バイト: マジック "BNGO", バージョン(u16), フラグ(u16), 枚数(u32), ジャーナルのバージョン(u32)
+    カード   枚数 x 41バイト: カード番号(16バイト, UTF-8, 0埋め) + 数字25個(各1バイト, 0は FREE)
+    マーク   枚数 x u32: 25bitのマーク状態（マス(i, j) はビット i*5+j）
+    成立済み 枚数 x u16: 12bitの成立済みライン（LINES の添字）
+各ブロックの先頭は8バイト境界にそろえる
+カード番号は全部が整数か全部が文字列のどちらか（混ざっている場合は書き出せない）
+
+ジャーナルモードではスナップショットを書き出すときに {data_file}.bcard も書き、
+ジャーナルのバージョンが合えば読み込み時にJSONの代わりに使う（GameJournal.read_binary）
+
+    python -m bingo_engine.binfile to-binary bingo_data_{アクセスID}.json cards.bcard
+    python -m bingo_engine.binfile to-json cards.bcard bingo_data_{アクセスID}.json
+
+@author: egumon
+"""
+
+import argparse
+import json
+
+import numpy as np
+
+from bingo_engine.journal import _atomic_write, atomic_write_json
+from bingo_engine.lines import LINE_KEYS
+from bingo_engine.store import CardStore
+
+MAGIC = b"BNGO"
+VERSION = 1
+FLAG_INT_IDS = 0x0001  # カード番号がすべて整数だった場合に立てる
+ID_BYTES = 16
+
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S4'), ('version', '<u2'), ('flags', '<u2'), ('count', '<u4'), ('journal_version', '<u4'),
+])
+RECORD_DTYPE = np.dtype([('card_id', f'S{ID_BYTES}'), ('numbers', 'u1', (25,))])
+
+_BIT_WEIGHTS = (np.uint32(1) << np.arange(25, dtype=np.uint32))
+
+
+def _align(offset):
+    return (offset + 7) // 8 * 8
+
+
+def _layout(count):
+    """各ブロックの (開始位置, ファイル全体の大きさ) を計算する"""
+    records = HEADER_DTYPE.itemsize
+    marks = _align(records + RECORD_DTYPE.itemsize * count)
+    won = _align(marks + 4 * count)
+    end = _align(won + 2 * count)
+    return records, marks, won, end
+
+
+def pack_marks(marked):
+    """(N, 5, 5) の bool 配列を N 個の25bit整数にする"""
+    n = len(marked)
+    packed = np.packbits(np.asarray(marked, dtype=bool).reshape(n, 25), axis=1, bitorder='little')
+    return packed.view('<u4').ravel()
+
+
+def unpack_marks(bits):
+    """N 個の25bit整数を (N, 5, 5) の bool 配列に戻す"""
+    bits = np.asarray(bits, dtype=np.uint32)
+    return ((bits[:, None] & _BIT_WEIGHTS) != 0).reshape(len(bits), 5, 5)
+
+
+def _encode_id(card_number):
+    encoded = str(card_number).encode('utf-8')
+    if len(encoded) > ID_BYTES:
+        raise ValueError(f"カード番号 {card_number} が長すぎます（{ID_BYTES}バイトまで）")
+    return encoded
+
+
+class BinaryCardFile:
+    def __init__(self, path, mode='r'):
+        """
+        バイナリ形式のカードファイルをメモリマップで開く
+        :param mode: 'r' は読み取り専用（ページを共有）、'r+' はマーク状態を書き戻せる
+        """
+        self.path = path
+        header = np.memmap(path, dtype=HEADER_DTYPE, mode='r', shape=(1,))[0]
+        if header['magic'] != MAGIC:
+            raise ValueError(f"{path} はビンゴカードのバイナリファイルではありません")
+        if header['version'] != VERSION:
+            raise ValueError(f"未対応のバージョンです: {header['version']}")
+        self.flags = int(header['flags'])
+        self.count = int(header['count'])
+        self.journal_version = int(header['journal_version'])
+        records, marks, won, _ = _layout(self.count)
+        self.records = np.memmap(path, dtype=RECORD_DTYPE, mode=mode, offset=records, shape=(self.count,))
+        self.marks = np.memmap(path, dtype='<u4', mode=mode, offset=marks, shape=(self.count,))
+        self.won = np.memmap(path, dtype='<u2', mode=mode, offset=won, shape=(self.count,))
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def numbers(self):
+        """(N, 5, 5) の数字配列（ファイルへのビューなのでコピーしない）"""
+        return self.records['numbers'].reshape(self.count, 5, 5)
+
+    def card_numbers(self):
+        card_ids = self.records['card_id']
+        if self.flags & FLAG_INT_IDS:
+            return card_ids.astype(np.int64).tolist()
+        return np.char.decode(card_ids, 'utf-8').tolist()
+
+    def to_card_store(self):
+        """
+        CardStore を作る。数字配列はファイルのビューをそのまま使い、マーク状態だけを展開する
+        """
+        store = CardStore(self.card_numbers(), self.numbers)
+        if self.count:
+            store.marked[:] = unpack_marks(self.marks)
+            won = np.asarray(self.won, dtype=np.uint16)
+            store.won[:] = (won[:, None] >> np.arange(len(LINE_KEYS), dtype=np.uint16)) & 1
+            store.remaining = store.count_remaining()
+        return store
+
+    def to_cards(self, card_class):
+        """
+        カードオブジェクトのリストを作る（JSONをパースしないので大量のカードでもすぐに読み込める）
+        :param card_class: from_packed を持つカードのクラス（CompactBingoCard）
+        """
+        flat = self.records['numbers'].tobytes()
+        marks = np.asarray(self.marks).tolist()
+        won = np.asarray(self.won).tolist()
+        return [
+            card_class.from_packed(card_number, flat[k * 25:k * 25 + 25], marks[k], won[k])
+            for k, card_number in enumerate(self.card_numbers())
+        ]
+
+    def write_marks(self, store):
+        """CardStore のマーク状態をファイルに書き戻す（mode='r+' で開いたとき）"""
+        self.marks[:] = pack_marks(store.marked)
+        self.won[:] = _won_bits(store.won)
+        self.marks.flush()
+        self.won.flush()
+
+    def to_dicts(self):
+        """to_dict 形式の辞書のリストに変換する"""
+        return self.to_card_store().to_dicts()
+
+
+def _id_flags(card_numbers):
+    """
+    カード番号の型のフラグ
+    :raises ValueError: 整数と文字列が混ざっている場合（読み込み時にどちらかにそろってしまうため）
+    """
+    ints = [isinstance(c, int) and not isinstance(c, bool) for c in card_numbers]
+    if all(ints):
+        return FLAG_INT_IDS if card_numbers else 0
+    if any(ints):
+        raise ValueError("整数と文字列のカード番号が混ざっているのでバイナリ形式にできません")
+    return 0
+
+
+def _won_bits(won):
+    return (np.asarray(won, dtype=np.uint16) << np.arange(len(LINE_KEYS), dtype=np.uint16)).sum(axis=1)
+
+
+def write_binary(path, card_numbers, numbers, marked=None, won=None, journal_version=0):
+    """
+    カードをバイナリ形式で書き出す（一時ファイル経由で置き換える）
+    :param numbers: (N, 5, 5) の数字配列
+    :param marked: (N, 5, 5) の bool 配列（None なら FREE のみマーク）
+    :param won: (N, 12) の bool 配列（None なら成立済みなし）
+    :param journal_version: スナップショットとして書くときのジャーナルのバージョン
+    :raises ValueError: カード番号が長すぎる、または整数と文字列が混ざっている場合
+    """
+    card_numbers = list(card_numbers)
+    count = len(card_numbers)
+    if marked is None:
+        marked = np.zeros((count, 5, 5), dtype=bool)
+        marked[:, 2, 2] = True
+    if won is None:
+        won = np.zeros((count, len(LINE_KEYS)), dtype=bool)
+    _write(path, card_numbers, numbers, pack_marks(marked), _won_bits(won), journal_version)
+
+
+def write_cards(path, cards, journal_version=0):
+    """
+    カードオブジェクト（BingoCard / CompactBingoCard）のリストをバイナリ形式で書き出す
+    マーク状態は card.mask、成立済みラインは won（CompactBingoCard）か bingo_lines から作るので to_dict を経由しない
+    """
+    numbers = np.frombuffer(b"".join(bytes(card.grid_key) for card in cards), dtype=np.uint8)
+    marks = np.fromiter((card.mask for card in cards), dtype=np.uint32, count=len(cards))
+    won = np.fromiter((_card_won(card) for card in cards), dtype=np.uint16, count=len(cards))
+    _write(path, [card.card_number for card in cards], numbers, marks, won, journal_version)
+
+
+def _card_won(card):
+    won = getattr(card, 'won', None)  # CompactBingoCard は成立済みラインを12bitの整数で持つ
+    if won is None:
+        won = sum(1 << k for k, key in enumerate(LINE_KEYS) if key in card.bingo_lines)
+    return won
+
+
+def _write(path, card_numbers, numbers, marks, won_bits, journal_version):
+    count = len(card_numbers)
+    flags = _id_flags(card_numbers)
+    numbers = np.asarray(numbers, dtype=np.uint8).reshape(count, 25)
+
+    records_offset, marks_offset, won_offset, end = _layout(count)
+    buf = np.zeros(end, dtype=np.uint8)
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header[0] = (MAGIC, VERSION, flags, count, journal_version)
+    buf[:HEADER_DTYPE.itemsize] = header.view(np.uint8)
+    records = np.zeros(count, dtype=RECORD_DTYPE)
+    records['card_id'] = [_encode_id(c) for c in card_numbers]
+    records['numbers'] = numbers
+    buf[records_offset:records_offset + records.nbytes] = records.view(np.uint8)
+    buf[marks_offset:marks_offset + 4 * count] = np.asarray(marks).astype('<u4').view(np.uint8)
+    buf[won_offset:won_offset + 2 * count] = np.asarray(won_bits).astype('<u2').view(np.uint8)
+    _atomic_write(path, lambda f: f.write(buf.tobytes()), binary=True)
+
+
+def json_to_binary(json_file, binary_file):
+    """save_cards が書き出したJSONファイルをバイナリ形式に変換する"""
+    with open(json_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    store = CardStore.from_dicts(data)
+    write_binary(binary_file, store.card_numbers, store.numbers, store.marked, store.won)
+    return len(store)
+
+
+def binary_to_json(binary_file, json_file):
+    """バイナリ形式のファイルを save_cards と同じJSON形式に変換する"""
+    data = BinaryCardFile(binary_file).to_dicts()
+    atomic_write_json(json_file, data)
+    return len(data)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="カードファイルのJSON形式とバイナリ形式（.bcard）の変換")
+    parser.add_argument("command", choices=["to-binary", "to-json"])
+    parser.add_argument("src", help="変換元のファイル")
+    parser.add_argument("dst", help="変換先のファイル")
+    args = parser.parse_args(argv)
+    try:
+        if args.command == "to-binary":
+            count = json_to_binary(args.src, args.dst)
+        else:
+            count = binary_to_json(args.src, args.dst)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"{count} 枚のカードを {args.dst} に書き出しました")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+カードの持ち方（バックエンド）を選べるビンゴ判定の共通インターフェース
+CLI・再生・ベンチマークなど画面を持たない処理は、カードの枚数に合わせてここでバックエンドを選ぶ
+
+    "python"  ... BingoCard のリスト（二重リストでマーク状態を持つ。少ない枚数向け）
+    "compact" ... CompactBingoCard のリスト（数字は bytes、マーク状態は25bit整数）
+    "array"   ... CardStore（NumPy で全カードを一度に判定する。多い枚数向け）
+
+"python" と "compact" は CardGame（bingo_engine.game）で、画面・HTTP サービスの SharedGame もその上に作っている
+どのバックエンドも次の操作を同じ形で持つ
+    call(number)        -> [(カード番号, [パターン名, ...]), ...]（新しいビンゴ）
+    retract(number)     呼ばれた番号を取り消す
+    add_cards(card_numbers, numbers)（登録済みのカード番号なら ValueError） / remove_card(card_number)
+    replay(records)     ジャーナルのレコードを適用する
+    winners()           -> [(カード番号, [パターン名, ...]), ...]（今ビンゴになっているライン全部）
+    to_dicts()          save_cards と同じ to_dict 形式
+    card_numbers, len()
+
+numpy は "array" を選んだときに初めて読み込む
+
+@author: egumon
+"""
+
+from bingo_engine.game import BingoCard, CardGame, CompactBingoCard, select_backend
+
+BACKENDS = ("python", "compact", "array")
+
+_CARD_CLASSES = {"python": BingoCard, "compact": CompactBingoCard}
+
+
+def _fits_in_bytes(numbers):
+    """CardStore は数字を uint8 で持つので、以前の版で登録できた範囲外の数字が無いかを調べる"""
+    import numpy as np
+    numbers = np.asarray(numbers)
+    return numbers.size == 0 or (numbers.min() >= 0 and numbers.max() <= 255)
+
+
+def _check_backend(backend, count, numbers=()):
+    """
+    :param numbers: カードの数字（"array" で持てるかを調べる）。範囲外の数字があれば自動では "compact" にする
+    """
+    if backend is None:
+        backend = select_backend(count)
+        if backend == "array" and not _fits_in_bytes(numbers):
+            backend = "compact"  # 範囲外の数字のカードは make_card が BingoCard で持つ
+        return backend
+    if backend not in BACKENDS:
+        raise ValueError(f"バックエンドは {', '.join(BACKENDS)} のどれかを指定してください: {backend}")
+    if backend == "array" and not _fits_in_bytes(numbers):
+        raise ValueError("0から255の範囲外の数字があるカードは array では扱えません")
+    return backend
+
+
+def new_game(card_numbers=(), numbers=(), backend=None):
+    """
+    カードを作ってゲームを始める
+    :param numbers: 5x5の数字のリスト（または (N, 5, 5) の配列）
+    :param backend: BACKENDS のどれか。None なら枚数に合わせて select_backend で選ぶ
+    """
+    card_numbers = list(card_numbers)
+    backend = _check_backend(backend, len(card_numbers), numbers)
+    if backend == "array":
+        from bingo_engine.store import CardStore
+        return CardStore(card_numbers, numbers if card_numbers else None)
+    game = CardGame(card_class=_CARD_CLASSES[backend])
+    game.add_cards(card_numbers, numbers)
+    return game
+
+
+def game_from_dicts(data, backend=None):
+    """to_dict 形式の辞書のリストから、枚数に合わせたバックエンドで作る"""
+    backend = _check_backend(backend, len(data), [d['numbers'] for d in data])
+    if backend == "array":
+        from bingo_engine.store import CardStore
+        return CardStore.from_dicts(data)
+    return CardGame.from_dicts(data, _CARD_CLASSES[backend])
@@ -0,0 +1,815 @@
+# -*- coding: utf-8 -*-
+"""
+ゲームの状態（カード・番号の逆引き・ジャーナル）
+Streamlit の画面（BingoChecker_UI.py）と HTTP サービス（bingo_engine.server）の両方から使うので、
+ここでは streamlit を読み込まない
+
+@author: egumon
+"""
+
+import itertools
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+from bingo_engine.history import DrawHistory
+from bingo_engine.journal import GameJournal, atomic_write_json, replay
+from bingo_engine.lines import LINES, LINE_KEYS, LINE_LABELS, LINE_MASKS, CELL_LINES, CELL_LINE_MASKS, FREE_MASK, cells_mask, grid_key
+from bingo_engine.metrics import METRICS
+from bingo_engine.patterns import PATTERNS, Pattern, PatternChecker
+from bingo_engine.reach import ReachBoard
+# この枚数以上のカードを読み込むときは CompactBingoCard を使う
+COMPACT_CARD_THRESHOLD = 1000
+# この枚数以上のカードは CardStore でまとめて判定する（benchmarks/bench_bingo.py の結果から決めた値）
+ARRAY_CARD_THRESHOLD = 5000
+
+# True: 変更をジャーナルに追記する / False: 変更のたびにJSONファイル全体を書き直す
+USE_JOURNAL = True
+
+
+# 25マスの添字 -> (行, 列)
+_CELLS = [divmod(pos, 5) for pos in range(25)]
+
+# マーク状態が変わるたびに振る通し番号（表示キャッシュのキーに使う。カードをまたいで重複しない）
+_MARK_VERSIONS = itertools.count(1)
+
+class BingoCard:
+    def __init__(self, card_number, numbers):
+        self.card_number = card_number
+        self.numbers = numbers
+        self.grid_key = grid_key(numbers)
+        self.marked = [[False for _ in range(5)] for _ in range(5)]
+        self.mark_cell(2, 2)  # FREE space
+        self.bingo_lines = set()
+
+    @property
+    def marked(self):
+        return self._marked
+
+    @marked.setter
+    def marked(self, value):
+        # マーク状態をまとめて差し替えるとき（JSONからの読み込みなど）はライン残数を数え直す
+        self._marked = value
+        self.mark_version = next(_MARK_VERSIONS)
+        self.mask = cells_mask((i, j) for i in range(5) for j in range(5) if value[i][j])  # 特別な形の判定用
+        self.remaining = [sum(not value[i][j] for i, j in cells) for _, _, cells in LINES]
+        self._completed = [k for k, left in enumerate(self.remaining) if left == 0]
+
+    def mark_number(self, number):
+        marked = False
+        for i in range(5):
+            for j in range(5):
+                if self.numbers[i][j] == number:
+                    self.mark_cell(i, j)
+                    marked = True
+        return marked
+
+    def mark_cell(self, i, j):
+        """
+        マスをマークし、そのマスを通るライン（2〜4本）の残り数だけを減らす
+        残り数が0になったラインは次の check_bingo で報告される
+        """
+        if self._marked[i][j]:
+            return
+        self._marked[i][j] = True
+        self.mark_version = next(_MARK_VERSIONS)
+        self.mask |= 1 << (i * 5 + j)
+        for k in CELL_LINES[i][j]:
+            self.remaining[k] -= 1
+            if self.remaining[k] == 0:
+                self._completed.append(k)
+
+    def unmark_number(self, number):
+        """呼ばれた番号の取り消し（その番号のマスのマークを外す）"""
+        unmarked = False
+        for i in range(5):
+            for j in range(5):
+                if self.numbers[i][j] == number and (i, j) != (2, 2):
+                    self.unmark_cell(i, j)
+                    unmarked = True
+        return unmarked
+
+    def unmark_cell(self, i, j):
+        """
+        マスのマークを外し、そのマスを通るラインの残り数だけを増やす
+        そのラインで成立していたビンゴは取り消す
+        """
+        if not self._marked[i][j]:
+            return
+        self._marked[i][j] = False
+        self.mark_version = next(_MARK_VERSIONS)
+        self.mask &= ~(1 << (i * 5 + j))
+        for k in CELL_LINES[i][j]:
+            if self.remaining[k] == 0:
+                self.bingo_lines.discard(LINES[k][0])
+                if k in self._completed:
+                    self._completed.remove(k)
+            self.remaining[k] += 1
+
+    def check_bingo(self):
+        """前回の呼び出し以降に残り数が0になったラインだけを新しいビンゴとして返す"""
+        new_bingo_patterns = []
+        for k in sorted(self._completed):
+            line_key, label, _ = LINES[k]
+            if line_key not in self.bingo_lines:
+                new_bingo_patterns.append(label)
+                self.bingo_lines.add(line_key)
+        self._completed = []
+        return new_bingo_patterns
+    
+    def to_dict(self): # <--- 追加: 辞書に変換するメソッド
+        return {
+            "card_number": self.card_number,
+            "numbers": self.numbers,
+            # marked は True/False の二重リストなのでそのまま保存可能
+            "marked": self.marked,
+            # setはJSONにできないのでlistに変換
+            "bingo_lines": list(self.bingo_lines) 
+        }
+
+class NumberIndex:
+    """
+    番号(1-75) → その番号を持つカード上の位置 (カードのグループ, 行, 列) の転置インデックス
+    呼ばれた番号を持つカードだけを訪問できるように、ゲーム単位で1つ持つ
+    同じ数字のカード（grid_key が同じカード）は1つのグループにまとめ、位置はグループごとに1回だけ持つ
+    （まとめるのは索引の検索とリーチの計算だけで、マークと判定はグループの1枚ずつに行う）
+    マークしたカードだけのリーチ情報（ReachBoard）もここで一緒に更新する
+    """
+    def __init__(self, cards=()):
+        self.positions = {}  # number -> [(グループ, i, j), ...]
+        self.grids = {}  # grid_key -> 同じ数字のカードのリスト（グループ。登録順）
+        self.cards_by_number = {}  # カード番号 -> card（登録時の重複チェック用）
+        self.reach = ReachBoard()
+        self.reset(cards)
+
+    def add_card(self, card):
+        self.cards_by_number[card.card_number] = card
+        self.reach.update(card)
+        group = self.grids.get(card.grid_key)
+        if group is not None:
+            group.append(card)  # 同じ数字のカードが既にあれば、位置は登録済み
+            return
+        group = self.grids[card.grid_key] = [card]
+        positions = self.positions
+        # numbers の二重リストを作らずに、左上から横方向に並んだ grid_key をそのまま使う
+        for pos, number in enumerate(card.grid_key):
+            if pos != 12:  # FREEマスは番号を持たない
+                entry = (group, *_CELLS[pos])
+                entries = positions.get(number)
+                if entries is None:
+                    positions[number] = [entry]
+                else:
+                    entries.append(entry)
+
+    def remove_card(self, card):
+        if self.cards_by_number.get(card.card_number) is card:
+            del self.cards_by_number[card.card_number]
+            self.reach.remove(card.card_number)
+        group = self.grids.get(card.grid_key)
+        if group is None or not any(other is card for other in group):
+            return
+        group[:] = [other for other in group if other is not card]
+        if group:
+            return
+        del self.grids[card.grid_key]
+        for row in card.numbers:
+            for number in row:
+                entries = self.positions.get(number)
+                if entries is None:
+                    continue
+                entries = [entry for entry in entries if entry[0] is not group]
+                if entries:
+                    self.positions[number] = entries
+                else:
+                    del self.positions[number]
+
+    def reset(self, cards):
+        """カードのリストからインデックスを作り直す"""
+        self.positions = {}
+        self.grids = {}
+        self.cards_by_number = {}
+        self.reach = ReachBoard()
+        for card in cards:
+            self.add_card(card)
+
+    def same_grid(self, numbers):
+        """
+        同じ数字の登録済みカードを返す（登録・一括登録のときの重複チェック用）
+        :param numbers: 5x5の数字リスト
+        :return: カードのリスト（無ければ空）
+        """
+        return list(self.grids.get(grid_key(numbers), ()))
+
+    def lookup(self, number):
+        """番号を持つ (グループ, i, j) のリストを返す"""
+        return self.positions.get(number, [])
+
+    def mark_number(self, number):
+        """
+        番号を持つマスだけをマークする
+        :return: マークされたカードのリスト（重複なし。同じ数字のカードは続けて並ぶ）
+        """
+        touched = []
+        marks = []  # (グループ, マークしたマスを通るライン) -> ReachBoard.update_marked
+        last = None
+        for group, i, j in self.lookup(number):
+            for card in group:
+                card.mark_cell(i, j)
+            if group is not last:
+                touched.extend(group)
+                marks.append((group, CELL_LINES[i][j]))
+                last = group
+            else:
+                # 同じカードに同じ番号が2つある（検証前の古いデータ）ときは両方のラインを数え直す
+                marks[-1] = (group, [*marks[-1][1], *CELL_LINES[i][j]])
+        # リーチ情報はマークしたマスを通るラインだけを数え直す
+        self.reach.update_marked(marks)
+        return touched
+
+    def unmark_number(self, number):
+        """
+        呼ばれた番号を取り消す（その番号を持つマスだけマークを外し、依存するビンゴも取り消す）
+        :return: マークを外したカードのリスト
+        """
+        touched = []
+        last = None
+        for group, i, j in self.lookup(number):
+            for card in group:
+                card.unmark_cell(i, j)
+            if group is not last:
+                touched.extend(group)
+                last = group
+        self.reach.update_cards(touched)
+        return touched
+
+class CompactBingoCard:
+    """
+    BingoCard と同じインターフェースを持つ省メモリ版のカード
+    数字は25バイトの bytes、マーク状態は25bitの整数、
+    成立済みラインは12bitの整数で持つので、ビンゴ判定はマスクとのAND比較だけで済む
+    マークしたときはそのマスを通るラインのマスクだけを比較する
+    """
+    __slots__ = ("card_number", "_numbers", "mask", "won", "completed", "mark_version")
+
+    def __init__(self, card_number, numbers):
+        self.card_number = card_number
+        self._numbers = bytes(n for row in numbers for n in row)
+        self.mask = FREE_MASK  # FREE space
+        self.mark_version = next(_MARK_VERSIONS)
+        self.won = 0  # 成立済みラインのビット（LINE_MASKS の添字）
+        self.completed = 0  # 前回の check_bingo 以降に埋まったラインのビット
+
+    @classmethod
+    def from_packed(cls, card_number, numbers, mask, won):
+        """
+        バイナリ形式（bingo_engine.binfile）の値からそのまま作る
+        :param numbers: 25バイトの bytes
+        :param mask: 25bitのマーク状態
+        :param won: 12bitの成立済みライン
+        """
+        card = cls.__new__(cls)
+        card.card_number = card_number
+        card._numbers = numbers
+        card.mask = mask
+        card.mark_version = next(_MARK_VERSIONS)
+        card.won = won
+        card.completed = 0
+        for k, (_, _, line_mask) in enumerate(LINE_MASKS):
+            if mask & line_mask == line_mask:
+                card.completed |= 1 << k
+        return card
+
+    @property
+    def grid_key(self):
+        return self._numbers
+
+    @property
+    def numbers(self):
+        flat = self._numbers
+        return [list(flat[i*5:i*5+5]) for i in range(5)]
+
+    @property
+    def marked(self):
+        return [[bool(self.mask >> (i*5 + j) & 1) for j in range(5)] for i in range(5)]
+
+    @marked.setter
+    def marked(self, value):
+        self.mask = cells_mask((i, j) for i in range(5) for j in range(5) if value[i][j])
+        self.mark_version = next(_MARK_VERSIONS)
+        self.completed = 0
+        for k, (_, _, line_mask) in enumerate(LINE_MASKS):
+            if self.mask & line_mask == line_mask:
+                self.completed |= 1 << k
+
+    @property
+    def bingo_lines(self):
+        return {key for k, (key, _, _) in enumerate(LINE_MASKS) if self.won >> k & 1}
+
+    @bingo_lines.setter
+    def bingo_lines(self, value):
+        self.won = 0
+        for k, (key, _, _) in enumerate(LINE_MASKS):
+            if key in value:
+                self.won |= 1 << k
+
+    def mark_number(self, number):
+        if not 1 <= number <= 75:
+            return False
+        pos = self._numbers.find(number)
+        marked = pos >= 0
+        while pos >= 0:
+            self._mark_bit(pos)
+            pos = self._numbers.find(number, pos + 1)
+        return marked
+
+    def mark_cell(self, i, j):
+        self._mark_bit(i * 5 + j)
+
+    def _mark_bit(self, pos):
+        if self.mask >> pos & 1:
+            return
+        self.mask |= 1 << pos
+        self.mark_version = next(_MARK_VERSIONS)
+        mask = self.mask
+        for k, line_mask in CELL_LINE_MASKS[pos]:
+            if mask & line_mask == line_mask:
+                self.completed |= 1 << k
+
+    def unmark_number(self, number):
+        """呼ばれた番号の取り消し（その番号のマスのマークを外す）"""
+        if not 1 <= number <= 75:
+            return False
+        pos = self._numbers.find(number)
+        unmarked = pos >= 0
+        while pos >= 0:
+            self._unmark_bit(pos)
+            pos = self._numbers.find(number, pos + 1)
+        return unmarked
+
+    def unmark_cell(self, i, j):
+        self._unmark_bit(i * 5 + j)
+
+    def _unmark_bit(self, pos):
+        if not self.mask >> pos & 1:
+            return
+        self.mask &= ~(1 << pos)
+        self.mark_version = next(_MARK_VERSIONS)
+        # このマスを通るラインはもう埋まっていないので、成立済み・未報告の印を外す
+        for k, _ in CELL_LINE_MASKS[pos]:
+            self.won &= ~(1 << k)
+            self.completed &= ~(1 << k)
+
+    def check_bingo(self):
+        new_bingo_patterns = []
+        new = self.completed & ~self.won
+        if new:
+            for k, (_, label, _) in enumerate(LINE_MASKS):
+                if new >> k & 1:
+                    new_bingo_patterns.append(label)
+            self.won |= new
+        self.completed = 0
+        return new_bingo_patterns
+
+    def to_dict(self):
+        # BingoCard.to_dict と同じJSON形式で書き出す
+        return {
+            "card_number": self.card_number,
+            "numbers": self.numbers,
+            "marked": self.marked,
+            "bingo_lines": list(self.bingo_lines)
+        }
+def save_cards(cards, data_file): # <-- data_file を引数に追加
+    """ビンゴカードのリストをJSONファイルに保存する（一時ファイル経由で置き換える）"""
+    with METRICS.measure("persist", len(cards)):
+        data_to_save = [card.to_dict() for card in cards]
+        # data_file を使用
+        atomic_write_json(data_file, data_to_save)
+
+def make_card(card_number, numbers, card_class=BingoCard):
+    """
+    カードを作る。CompactBingoCard は数字を1バイトずつ持つので、以前の版では登録できた範囲外の数字
+    （入力ミスの 610 など）があるカードは、読み込みで落ちないように BingoCard で持つ
+    """
+    try:
+        return card_class(card_number, numbers)
+    except ValueError:
+        if card_class is BingoCard:
+            raise
+        return BingoCard(card_number, numbers)
+
+def card_from_dict(d, card_class=BingoCard):
+    """to_dict 形式の辞書からカードオブジェクトを再構築する"""
+    card = make_card(d['card_number'], d['numbers'], card_class)
+    card.marked = d['marked']
+    card.bingo_lines = set(d['bingo_lines']) # setに戻す
+    return card
+
+def select_backend(count):
+    """枚数に合わせたバックエンド名（"python" / "compact" / "array"）"""
+    if count >= ARRAY_CARD_THRESHOLD:
+        return "array"
+    if count >= COMPACT_CARD_THRESHOLD:
+        return "compact"
+    return "python"
+
+def card_class_for(count, compact=None):
+    """
+    枚数に合わせたカードのクラス（compact が None なら select_backend で決める）
+    カードオブジェクトで持つ画面・サービスのゲームでは、"array" の枚数でも CompactBingoCard を使う
+    """
+    if compact is None:
+        compact = select_backend(count) != "python"
+    return CompactBingoCard if compact else BingoCard
+
+def load_cards(data_file, compact=None): # <-- data_file を引数に追加
+    """
+    JSONファイルからビンゴカードを読み込む
+    :param compact: True なら CompactBingoCard、False なら BingoCard で読み込む。
+                    None の場合は枚数が COMPACT_CARD_THRESHOLD 以上なら CompactBingoCard を使う
+    """
+    # data_file を使用
+    if not os.path.exists(data_file):
+        return []
+        
+    with open(data_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    card_class = card_class_for(len(data), compact)
+    return [card_from_dict(d, card_class) for d in data]
+
+def load_game(data_file, compact=None):
+    """
+    ジャーナルモードでビンゴカードを読み込む（スナップショット + ジャーナルの残りを再生）
+    :return: (カードのリスト, GameJournal)
+    """
+    journal = GameJournal(data_file)
+    # 大きなゲームはバイナリのスナップショットがあれば JSON をパースせずに読み込む
+    binary = journal.read_binary() if compact is not False else None
+    if binary is not None and card_class_for(len(binary[0]), compact) is CompactBingoCard:
+        snapshot, records = binary
+        card_class = CompactBingoCard
+        cards = snapshot.to_cards(card_class)
+    else:
+        data, records = journal.read()
+        card_class = card_class_for(len(data), compact)
+        cards = [card_from_dict(d, card_class) for d in data]
+    journal.card_from_dict = lambda d: card_from_dict(d, card_class)
+    if card_class is CompactBingoCard:
+        journal.binary_card_class = card_class
+    replay(cards, records, journal.card_from_dict)
+    return cards, journal
+
+class CardGame:
+    """
+    カードオブジェクト（BingoCard / CompactBingoCard）のリストのゲーム（"python" / "compact" バックエンド）
+    CardStore と同じ操作（call / retract / add_cards / remove_card / replay / winners / to_dicts）に加えて、
+    カードオブジェクトで結果を返す play と特別な形の判定を持つ
+    """
+    def __init__(self, cards=(), card_class=None):
+        """
+        :param cards: カードオブジェクトのリスト（カードはそのまま使うので、マーク状態は共有される）
+        :param card_class: add_cards で作るカードのクラス。None なら追加後の枚数に合わせて card_class_for で選ぶ
+        """
+        self.cards = cards if isinstance(cards, list) else list(cards)
+        self.card_class = card_class
+        self.number_index = NumberIndex(self.cards)
+        self._called = []
+        # 選ばれている特別な形と、このゲームで追加した自作の形
+        self.patterns = PatternChecker()
+        self.custom_patterns = {}
+
+    @property
+    def backend(self):
+        return "compact" if self._card_class() is CompactBingoCard else "python"
+
+    def _card_class(self, adding=0):
+        return self.card_class or card_class_for(len(self.cards) + adding)
+
+    def __len__(self):
+        return len(self.cards)
+
+    @property
+    def card_numbers(self):
+        return [card.card_number for card in self.cards]
+
+    @property
+    def called(self):
+        """今呼ばれている番号（呼ばれた順）"""
+        return self._called
+
+    @classmethod
+    def from_dicts(cls, data, card_class=BingoCard):
+        """to_dict 形式（save_cards が書き出すJSONの中身）から作る"""
+        return cls([card_from_dict(d, card_class) for d in data], card_class)
+
+    def to_dicts(self):
+        return [card.to_dict() for card in self.cards]
+
+    def replay(self, records):
+        """ジャーナルのレコード（GameJournal.read が返すもの）を適用する"""
+        card_class = self._card_class()
+        replay(self.cards, records, lambda d: card_from_dict(d, card_class), self.number_index)
+        for record in records:
+            if record['op'] == 'call' and record['number'] not in self._called:
+                self._called.append(record['number'])
+            elif record['op'] == 'retract' and record['number'] in self._called:
+                self._called.remove(record['number'])
+        return self
+
+    def add_cards(self, card_numbers, numbers):
+        """
+        カードをまとめて追加する（CardStore.add_cards と同じく、登録済みのカード番号なら何も追加せずに ValueError）
+        :param numbers: 5x5の数字リストのリスト
+        :return: 追加したカードのリスト
+        """
+        card_numbers = list(card_numbers)
+        for card_number in card_numbers:
+            if card_number in self.number_index.cards_by_number:
+                raise ValueError(f"カード番号 {card_number} は既に登録されています")
+        card_class = self._card_class(len(card_numbers))
+        added = [make_card(card_number, [[int(n) for n in row] for row in grid], card_class)
+                 for card_number, grid in zip(card_numbers, numbers)]
+        for card in added:
+            self.cards.append(card)
+            self.number_index.add_card(card)
+        return added
+
+    def delete_card(self, card_number):
+        """:return: 削除したら True（登録されていなければ False）"""
+        card = self.number_index.cards_by_number.get(card_number)
+        if card is None:
+            return False
+        self.cards.remove(card)
+        self.number_index.remove_card(card)
+        self.patterns.forget(card_number)
+        return True
+
+    def remove_card(self, card_number):
+        """CardStore.remove_card と同じく、登録されていなければ KeyError"""
+        if not self.delete_card(card_number):
+            raise KeyError(card_number)
+
+    def mark_number(self, number):
+        """:return: 新しくマークされたカードのリスト"""
+        return self.number_index.mark_number(number)
+
+    def _mark_and_check(self, number):
+        with METRICS.measure("mark") as timer:
+            touched = self.number_index.mark_number(number)
+            timer.cards = len(touched)
+        with METRICS.measure("check", len(touched)):
+            bingos = [(card, card.check_bingo()) for card in touched]
+            # 選ばれている特別な形は、マークされたカード全部をまとめて判定する
+            pattern_results = self.patterns.check(touched)
+        bingos = [(card, patterns) for card, patterns in bingos if patterns]
+        return touched, bingos, pattern_results
+
+    def play(self, number):
+        """
+        番号を呼んで、その番号を持つカードだけをマークして判定する
+        :return: (マークされたカードのリスト,
+                  新しいビンゴの [(card, [表示名, ...]), ...],
+                  新しく揃った特別な形の [(card, [表示名, ...]), ...])
+                 既に呼ばれていた番号なら None
+        """
+        if number in self.called:
+            return None
+        result = self._mark_and_check(number)
+        self._called.append(number)
+        return result
+
+    def call(self, number):
+        """
+        番号をマークし、その番号でマークされたカードだけをビンゴ判定する
+        :return: [(カード番号, [パターン名, ...]), ...]（CardStore.call と同じ形）
+        """
+        result = self.play(number)
+        if result is None:
+            return []
+        return [(card.card_number, patterns) for card, patterns in result[1]]
+
+    def retract(self, number):
+        """
+        呼ばれた番号を取り消す（その番号を持つカードだけマークを外す）
+        :return: マークを外したカードのリスト
+        """
+        if number in self._called:
+            self._called.remove(number)
+        touched = self.number_index.unmark_number(number)
+        self.patterns.check(touched)  # 揃わなくなった形の印を外す
+        return touched
+
+    def winners(self):
+        """
+        今ビンゴになっているラインを全部返す（報告済みかどうかは問わない）
+        :return: [(カード番号, [パターン名, ...]), ...]
+        """
+        return [(card.card_number, [label for key, label in zip(LINE_KEYS, LINE_LABELS) if key in card.bingo_lines])
+                for card in self.cards if card.bingo_lines]
+
+    def set_patterns(self, keys):
+        """特別な形を選び直す（選んだ時点で揃っている形は報告済みとして扱う）"""
+        available = {**PATTERNS, **self.custom_patterns}
+        checker = PatternChecker(available[key] for key in keys if key in available)
+        checker.reset(self.cards)
+        self.patterns = checker
+
+    def add_custom_pattern(self, pattern):
+        """自作の形を追加して、選んでいる形に加える（同じキーの形は置き換える）"""
+        previous = self.custom_patterns
+        self.custom_patterns = {**previous, pattern.key: pattern}
+        keys = [p.key for p in self.patterns.patterns]
+        try:
+            self.set_patterns(keys if pattern.key in keys else keys + [pattern.key])
+        except ValueError:  # 同時に選べる形の数を超えた
+            self.custom_patterns = previous
+            raise
+
+class SharedGame(CardGame):
+    """
+    同じアクセスIDのセッション間で共有するゲームの状態
+    CardGame の操作を、ロック・ジャーナル（または data_file）・呼ばれた番号の履歴・形の選択の保存と一緒に行う
+    """
+    def __init__(self, cards, journal=None, data_file=None, history=None, patterns_file=None):
+        """
+        :param journal: ジャーナルモードの GameJournal（None なら変更のたびに data_file 全体を書き直す）
+        :param data_file: ジャーナルを使わないときの保存先
+        :param history: 呼ばれた番号の履歴 DrawHistory（全端末で共有する）
+        :param patterns_file: 選んだ特別な形と自作の形の保存先（全端末・HTTP サービスで共有する）
+        """
+        super().__init__(cards)
+        self.journal = journal
+        self.data_file = data_file
+        self.history = history
+        self._roster_changed = True  # 履歴に最後にカードを書いてから登録・削除があったかもしれない
+        self.lock = threading.RLock()
+        self.patterns_file = patterns_file
+        self._load_patterns()
+        if journal is not None:
+            # 他の端末が追記したレコードを取り込むときにインデックスも更新する
+            journal.index = self.number_index
+
+    def _load_patterns(self):
+        """
+        保存されている形の選択を読み込む（他の端末・プロセスが選び直した分を取り込む）
+        選択が変わっていなければ、揃ったことを報告済みの形の印はそのまま残す
+        """
+        if self.patterns_file is None or not os.path.exists(self.patterns_file):
+            return
+        try:
+            with open(self.patterns_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            custom = {d['key']: Pattern(d['key'], d['label'], d['mask']) for d in data.get('custom', ())}
+            keys = list(data.get('selected', ()))
+        except (OSError, ValueError, TypeError, KeyError, AttributeError):
+            return  # 壊れたファイルは無視して今の選択のまま
+        if custom != self.custom_patterns or keys != [p.key for p in self.patterns.patterns]:
+            self.custom_patterns = custom
+            super().set_patterns(keys)
+
+    def _save_patterns(self):
+        if self.patterns_file is not None:
+            atomic_write_json(self.patterns_file, {
+                "selected": [pattern.key for pattern in self.patterns.patterns],
+                "custom": [pattern._asdict() for pattern in self.custom_patterns.values()],
+            })
+
+    def set_patterns(self, keys):
+        with self.lock:
+            super().set_patterns(keys)
+            self._save_patterns()
+
+    def add_custom_pattern(self, pattern):
+        with self.lock:
+            super().add_custom_pattern(pattern)
+            self._save_patterns()
+
+    def sync(self):
+        """
+        他の端末・プロセスが追記した分だけを取り込む（GameRegistry から呼ばれる）
+        :return: 取り込めたら True、ファイル全体の読み込み直しが必要なら False
+        """
+        if self.journal is None:
+            return False
+        with self.lock:
+            self.journal.sync(self.cards)
+            if self.history is not None:
+                self.history.refresh()
+            self._load_patterns()
+            self._roster_changed = True
+        return True
+
+    @contextmanager
+    def transaction(self):
+        """
+        カードを書き換える間、他のセッション・他のプロセスの書き込みを止める
+        ジャーナルモードでは最新のバージョンに追いついてから中の処理を行う
+        """
+        with self.lock:
+            if self.journal is None:
+                yield self
+            else:
+                with self.journal.locked(self.cards):
+                    if self.history is not None:
+                        self.history.refresh()
+                    yield self
+
+    @property
+    def called(self):
+        """今呼ばれている番号（呼ばれた順）。全端末で共有する履歴から読む"""
+        return self.history.called if self.history is not None else self._called
+
+    def _save(self):
+        # ジャーナルを使わないときだけ、ループの外で一度だけ全体を書き直す
+        if self.data_file is not None:
+            save_cards(self.cards, self.data_file)
+
+    def add_cards(self, card_numbers, numbers):
+        """
+        カードをまとめて登録する（他の端末の登録に追いついてから重複を調べる）。保存は最後に一度だけ
+        :return: 登録したカードのリスト
+        :raises ValueError: 登録済みのカード番号があった場合（何も登録しない）
+        """
+        with self.transaction():
+            added = super().add_cards(card_numbers, numbers)
+            if added:
+                self._roster_changed = True
+                if self.journal is not None:
+                    self.journal.cards_added(added, self.cards)
+                else:
+                    self._save()
+        return added
+
+    def delete_card(self, card_number):
+        """
+        カード番号でカードを削除する（他の端末の登録・削除に追いついてから探す）
+        :return: 削除したら True
+        """
+        with self.transaction():
+            if not super().delete_card(card_number):
+                return False
+            self._roster_changed = True
+            if self.journal is not None:
+                self.journal.card_deleted(card_number, self.cards)
+            else:
+                self._save()
+        return True
+
+    def play(self, number):
+        """
+        番号を呼んで判定する（CardGame.play と同じ結果。他の端末が既に呼んでいた番号なら None）
+        ジャーナルモードでは、他の端末と呼ばれた番号を共有するため毎回追記する
+        """
+        with self.transaction():
+            if number in self.called:
+                return None
+            touched, bingos, pattern_results = self._mark_and_check(number)
+            if self.journal is not None:
+                self.journal.number_called(number, self.cards)
+            elif touched:
+                self._save()
+            if self.history is not None:
+                self.history.record_call(number, self.cards, bingos, pattern_results, self._roster_changed)
+                self._roster_changed = False
+            else:
+                self._called.append(number)
+        return touched, bingos, pattern_results
+
+    def retract(self, number):
+        """
+        呼ばれた番号を取り消す（その番号を持つカードだけマークを外す）
+        :return: マークを外したカードのリスト（他の端末が既に取り消していたら空）
+        """
+        with self.transaction():
+            if self.history is not None and number not in self.called:
+                return []  # 他の端末が既に取り消していた
+            touched = super().retract(number)
+            if self.journal is not None:
+                self.journal.number_retracted(number, self.cards)
+            elif touched:
+                self._save()
+            if self.history is not None:
+                self.history.record_retract(number)
+        return touched
+
+def data_file_for(access_id):
+    # 例: "bingo_data_userA.json", "bingo_data_userB.json" のように分かれる
+    return f"bingo_data_{access_id}.json"
+
+def watch_files_for(access_id):
+    """GameRegistry が変更を監視するファイル（スナップショット・ジャーナル・呼ばれた番号の履歴・特別な形）"""
+    data_file = data_file_for(access_id)
+    return [data_file, f"{data_file}.journal", f"{data_file}.draws", f"{data_file}.patterns"]
+
+def load_shared_game(access_id):
+    data_file = data_file_for(access_id)
+    with METRICS.measure("load") as timer:
+        history = DrawHistory(f"{data_file}.draws")
+        patterns_file = f"{data_file}.patterns"
+        if USE_JOURNAL:
+            game = SharedGame(*load_game(data_file), history=history, patterns_file=patterns_file)
+        else:
+            game = SharedGame(load_cards(data_file), data_file=data_file, history=history,
+                              patterns_file=patterns_file)
+        timer.cards = len(game)
+    return game
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+呼ばれた番号の履歴（アクセスIDごとに保存し、全端末で共有する）
+番号・時刻・その番号で出たビンゴを1行1レコードの JSON Lines（{data_file}.draws）に追記する
+ジャーナルと違って圧縮しないので、ゲームの最初から何回目の番号でも状態を作り直せる
+
+    {"op": "cards", "added": [{"card_number": ..., "numbers": 5x5, "mask": ...}, ...], "deleted": [...]}
+        前回の記録からカードの登録・削除があったときだけ、番号を呼ぶ直前に差分を書く
+        mask はそのときのマーク状態（25bit）。途中で登録したカードは、それより前の番号ではマークされない
+    {"op": "call", "draw": 12, "number": 34, "time": "...", "winners": [...], "patterns": [...]}
+    {"op": "retract", "number": 34, "time": "..."}
+    {"op": "checkpoint", "draw": 10, "called": [...], "masks": [[カード番号, mask], ...]}
+        CHECKPOINT_EVERY 回ごとの、その時点で呼ばれている番号と全カードのマーク状態
+
+state_at は直前のチェックポイントからマーク状態を戻し、その後ろのレコードだけを CardStore で再生する
+
+@author: egumon
+"""
+
+import datetime
+import os
+
+from bingo_engine.journal import append_jsonl, read_jsonl_tail
+
+# この回数ごとにチェックポイントを書く
+CHECKPOINT_EVERY = 10
+
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+
+class DrawHistory:
+    def __init__(self, path):
+        """
+        :param path: 履歴のファイル名（{data_file}.draws）
+        """
+        self.path = path
+        self.records = []  # ファイルの全レコード（書かれた順）
+        self.called = []  # 今呼ばれている番号（呼ばれた順）
+        self.draws = 0  # これまでの call レコードの数（取り消した番号も数える）
+        self.roster = {}  # 最後に記録したカード: カード番号 -> 5x5の数字
+        self.offset = 0
+        self.refresh()
+
+    def refresh(self):
+        """他の端末・プロセスが追記した分だけを読み込む"""
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return
+        if size < self.offset:  # 作り直された
+            self.__init__(self.path)
+            return
+        records, self.offset = read_jsonl_tail(self.path, self.offset)
+        for record in records:
+            self._apply(record)
+
+    def _apply(self, record):
+        self.records.append(record)
+        op = record['op']
+        if op == 'cards':
+            for card in record['added']:
+                self.roster[card['card_number']] = card['numbers']
+            for card_number in record['deleted']:
+                self.roster.pop(card_number, None)
+        elif op == 'call':
+            self.draws = record['draw']
+            if record['number'] not in self.called:
+                self.called.append(record['number'])
+        elif op == 'retract':
+            if record['number'] in self.called:
+                self.called.remove(record['number'])
+
+    def _append(self, records):
+        self.offset = append_jsonl(self.path, records, self.offset)
+        for record in records:
+            self._apply(record)
+
+    def record_call(self, number, cards, bingos=(), pattern_results=(), roster_changed=True):
+        """
+        呼ばれた番号を追記する（ゲームのロックを取った中で、マークと判定の後に呼ぶこと）
+        :param cards: 今のカードのリスト（前回から登録・削除があれば差分も書く）
+        :param bingos: SharedGame.call が返す新しいビンゴの [(card, [表示名, ...]), ...]
+        :param pattern_results: 新しく揃った特別な形の [(card, [表示名, ...]), ...]
+        :param roster_changed: False ならカードの差分を調べない（前回から登録・削除が無いと分かっているとき）
+        """
+        records = []
+        if roster_changed:
+            current = {card.card_number: card for card in cards}
+            added = [card for card_number, card in current.items() if card_number not in self.roster]
+            deleted = [card_number for card_number in self.roster if card_number not in current]
+            if added or deleted:
+                # マークはこの番号を呼ぶ前の状態で書く（この番号の分は call レコードで当てはめる）
+                records.append({
+                    "op": "cards",
+                    "added": [{"card_number": card.card_number, "numbers": card.numbers,
+                               "mask": _mask_before(card, number)} for card in added],
+                    "deleted": deleted,
+                })
+        draw = self.draws + 1
+        records.append({
+            "op": "call", "draw": draw, "number": number, "time": _now(),
+            "winners": [{"card_number": card.card_number, "lines": lines} for card, lines in bingos],
+            "patterns": [{"card_number": card.card_number, "patterns": labels} for card, labels in pattern_results],
+        })
+        if draw % CHECKPOINT_EVERY == 0:
+            records.append({
+                "op": "checkpoint", "draw": draw,
+                "called": [n for n in self.called if n != number] + [number],
+                "masks": [[card.card_number, card.mask] for card in cards],
+            })
+        self._append(records)
+
+    def record_retract(self, number):
+        self._append([{"op": "retract", "number": number, "time": _now()}])
+
+    def calls(self):
+        """call レコードのリスト（一覧表示・確認用）"""
+        return [record for record in self.records if record['op'] == 'call']
+
+    def state_at(self, draw):
+        """
+        draw 回目の番号を呼んだ直後の状態を作り直す（次の番号までに取り消された番号も反映する）
+        :return: (CardStore, その時点で呼ばれている番号のリスト)
+                 CardStore はマークだけした状態なので、check_bingo() でその時点のビンゴが全部返る
+        """
+        if not 0 <= draw <= self.draws:
+            raise ValueError(f"0 から {self.draws} の回数を指定してください")
+        # numpy は作り直すときに初めて読み込む（番号を記録するだけなら不要なので）
+        from bingo_engine.store import CardStore
+        # 直前のチェックポイントを探す（無ければ最初から）
+        start = 0
+        for k, record in enumerate(self.records):
+            if record['op'] == 'checkpoint' and record['draw'] <= draw:
+                start = k
+        store, called = CardStore(), []
+        if start:
+            checkpoint = self.records[start]
+            roster = {}
+            for record in self.records[:start]:
+                if record['op'] == 'cards':
+                    for card in record['added']:
+                        roster[card['card_number']] = card['numbers']
+                    for card_number in record['deleted']:
+                        roster.pop(card_number, None)
+            masks = [(card_number, mask) for card_number, mask in checkpoint['masks'] if card_number in roster]
+            store = CardStore([card_number for card_number, _ in masks],
+                              [roster[card_number] for card_number, _ in masks] or None)
+            store.set_masks([mask for _, mask in masks])
+            called = list(checkpoint['called'])
+            start += 1
+        # チェックポイントの後ろのレコードを順に再生する
+        for k in range(start, len(self.records)):
+            record = self.records[k]
+            op = record['op']
+            if op == 'cards':
+                if self.records[k + 1]['draw'] > draw:
+                    break  # 次の番号を呼ぶ直前に書かれた差分なので、draw 回目の時点にはまだ無い
+                for card_number in record['deleted']:
+                    if card_number in store.positions:
+                        store.remove_card(card_number)
+                added = [card for card in record['added'] if card['card_number'] not in store.positions]
+                if added:
+                    offset = len(store)
+                    store.add_cards([card['card_number'] for card in added], [card['numbers'] for card in added])
+                    store.set_masks([card['mask'] for card in added], slice(offset, None))
+            elif op == 'call':
+                if record['draw'] > draw:
+                    break
+                store.mark_number(record['number'])
+                if record['number'] not in called:
+                    called.append(record['number'])
+            elif op == 'retract':
+                store.retract(record['number'])
+                if record['number'] in called:
+                    called.remove(record['number'])
+        return store, called
+
+
+def _mask_before(card, number):
+    """この番号を呼ぶ前のマーク状態（この番号のマスのマークを外したもの）"""
+    mask = card.mask
+    for pos, n in enumerate(n for row in card.numbers for n in row):
+        if n == number:
+            mask &= ~(1 << pos)
+    return mask
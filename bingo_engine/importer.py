@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+CSV / JSON Lines / JSON ファイルからのカードの一括登録
+CSV・JSON Lines は1行ずつ読みながら検証するので、大きなファイルでも全体をメモリに載せない
+
+CSV: 1行1枚。カード番号の後に25個の数字を左上から横方向に並べる（真ん中の FREE は 0）
+    5890,13,22,42,49,61,6,21,38,57,64,2,16,0,55,66,11,23,35,58,65,5,29,45,53,70
+    先頭行が見出し（1列目が数字でもカード番号らしくもない行）の場合は読み飛ばす
+JSON Lines: 1行1枚。to_dict と同じキーの "card_number" と "numbers"（5x5の数字リスト）
+    {"card_number": "5890", "numbers": [[13, 22, 42, 49, 61], ...]}
+JSON: 同じ形の辞書の配列（save_cards が書き出す bingo_data_{アクセスID}.json をそのまま読める。マーク状態は読まない）
+    配列全体を一度に読み込むので、大きなファイルは JSON Lines か CSV を使う。行番号の代わりに配列の何番目か（1から）を返す
+カード番号は画面の入力と同じく文字列にそろえる（JSON の数字 5890 は "5890" として登録する）
+
+@author: egumon
+"""
+
+import csv
+import io
+import json
+
+from bingo_engine.lines import grid_key
+
+FORMATS = ("csv", "jsonl", "json")
+
+
+class ImportReport:
+    def __init__(self):
+        self.cards = []  # 登録できるカード [(カード番号, 5x5の数字リスト), ...]
+        self.rejected = []  # 登録できなかった行 [(行番号, カード番号, 理由), ...]
+        # 登録済み・ファイル内の前の行と同じ数字のカード [(行番号, カード番号, 同じ数字のカード番号), ...]
+        # 登録はする（同じ数字のカードは判定を1回にまとめる）
+        self.duplicates = []
+
+    def __len__(self):
+        return len(self.cards)
+
+
+def detect_format(filename):
+    """拡張子からファイル形式を判定する（.jsonl / .ndjson は JSON Lines、.json は配列の JSON）"""
+    filename = filename.lower()
+    if filename.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    if filename.endswith(".json"):
+        return "json"
+    return "csv"
+
+
+def validate_numbers(numbers):
+    """
+    カードの数字を検証する
+    :return: 問題があれば理由の文字列、問題が無ければ None
+    """
+    if not isinstance(numbers, list) or len(numbers) != 5 or any(
+            not isinstance(row, list) or len(row) != 5 for row in numbers):
+        return "5x5の数字になっていません"
+    if any(not isinstance(n, int) or isinstance(n, bool) for row in numbers for n in row):
+        return "数字以外の値があります"
+    if numbers[2][2] != 0:
+        return "真ん中（FREE）が 0 になっていません"
+    others = [numbers[i][j] for i in range(5) for j in range(5) if (i, j) != (2, 2)]
+    if any(not 1 <= n <= 75 for n in others):
+        return "1から75の範囲外の数字があります"
+    if len(set(others)) != len(others):
+        return "同じカードの中に重複した数字があります"
+    return None
+
+
+def _csv_rows(stream):
+    reader = csv.reader(stream)
+    for line_no, row in enumerate(reader, start=1):
+        row = [cell.strip() for cell in row]
+        if not any(row):
+            continue
+        if line_no == 1 and len(row) > 1 and not row[1].lstrip("-").isdigit():
+            continue  # 見出し行
+        card_number = row[0]
+        try:
+            values = [int(cell) for cell in row[1:]]
+        except ValueError:
+            yield line_no, card_number, None, "数字以外の値があります"
+            continue
+        if len(values) != 25:
+            yield line_no, card_number, None, f"数字が25個ではありません（{len(values)}個）"
+            continue
+        yield line_no, card_number, [values[i*5:i*5+5] for i in range(5)], None
+
+
+def _card_row(line_no, d):
+    """JSON Lines の1行・JSON の配列の1要素（辞書）を (行番号, カード番号, 数字, 理由) にする"""
+    try:
+        card_number = d["card_number"]
+        numbers = d["numbers"]
+    except (TypeError, KeyError):
+        return line_no, None, None, "card_number と numbers を持つJSONではありません"
+    if isinstance(card_number, bool) or not isinstance(card_number, (str, int)):
+        return line_no, None, None, "カード番号が文字列か数字ではありません"
+    # 画面の入力・CSV と同じく文字列にそろえる（5890 と "5890" を別のカードにしない）
+    return line_no, str(card_number).strip(), numbers, None
+
+
+def _jsonl_rows(stream):
+    for line_no, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            d = json.loads(line)
+        except json.JSONDecodeError:
+            yield line_no, None, None, "card_number と numbers を持つJSONではありません"
+            continue
+        yield _card_row(line_no, d)
+
+
+def _json_rows(stream):
+    try:
+        data = json.load(stream)
+    except json.JSONDecodeError:
+        data = None
+    if not isinstance(data, list):
+        yield 1, None, None, "カードの辞書の配列になっていません"
+        return
+    for k, d in enumerate(data, start=1):
+        yield _card_row(k, d)
+
+
+def import_cards(stream, fmt="csv", existing=(), grids=None):
+    """
+    ファイルからカードを1行ずつ読み、検証して登録できるカードと却下した行に分ける
+    :param stream: テキストのストリーム（バイナリの場合は UTF-8 として読む）
+    :param fmt: "csv"・"jsonl"・"json" のどれか
+    :param existing: 登録済みのカード番号（set や dict など in で O(1) に調べられるもの）
+    :param grids: 登録済みのカードの grid_key -> カードのリスト（NumberIndex.grids）。
+                  渡すと同じ数字のカードを report.duplicates に書く
+    :return: ImportReport
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"未対応のファイル形式です: {fmt}")
+    if isinstance(stream, (io.BufferedIOBase, io.RawIOBase)) or hasattr(stream, "getbuffer"):
+        stream = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    rows = {"csv": _csv_rows, "jsonl": _jsonl_rows, "json": _json_rows}[fmt](stream)
+
+    report = ImportReport()
+    seen = set()  # このファイルの中で既に出てきたカード番号
+    seen_grids = {}  # このファイルの中で既に出てきた grid_key -> カード番号
+    for line_no, card_number, numbers, reason in rows:
+        if reason is None:
+            if card_number in (None, ""):
+                reason = "カード番号がありません"
+            elif card_number in existing or (card_number.isdigit() and int(card_number) in existing):
+                # 以前の版で数字のまま登録されたカード番号とも比べる
+                reason = "このカード番号は既に登録されています"
+            elif card_number in seen:
+                reason = "ファイルの中でカード番号が重複しています"
+            else:
+                reason = validate_numbers(numbers)
+        if reason is not None:
+            report.rejected.append((line_no, card_number, reason))
+            continue
+        seen.add(card_number)
+        if grids is not None:
+            key = grid_key(numbers)
+            twins = grids.get(key)
+            if twins:
+                report.duplicates.append((line_no, card_number, twins[0].card_number))
+            elif key in seen_grids:
+                report.duplicates.append((line_no, card_number, seen_grids[key]))
+            else:
+                seen_grids[key] = card_number
+        report.cards.append((card_number, numbers))
+    return report
@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+"""
+追記型のゲームジャーナル
+カードの追加・削除・番号の呼び出しと取り消しを1行1レコードの JSON Lines で追記し、
+一定件数ごとにカード一覧のスナップショット（save_cards と同じJSON形式）を書き出して圧縮する
+読み込み時は スナップショット + ジャーナルの残り を再生して状態を復元する
+
+レコードには1ずつ増えるバージョン番号を付ける。書き込みはファイルロックを取ってから、
+他の書き手が追記した分を先に取り込み（compare-and-swap）、その次のバージョンで追記するので、
+同じアクセスIDを複数の端末・プロセスで同時に更新しても書き込みが失われない
+
+@author: egumon
+"""
+
+import json
+import os
+import tempfile
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from bingo_engine.metrics import METRICS
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# この件数のレコードが溜まったらスナップショットを書き出してジャーナルを空にする
+SNAPSHOT_EVERY = 500
+# events_since のためにメモリ上に残しておくレコード数
+KEEP_EVENTS = 1000
+# この枚数以上のスナップショットは、JSONと一緒にバイナリ形式（{data_file}.bcard）でも書き出す
+BINARY_SNAPSHOT_CARDS = 1000
+
+
+def atomic_write_json(path, data, indent=4):
+    """一時ファイルに書いてから置き換えるので、途中で落ちても壊れたファイルが残らない"""
+    _atomic_write(path, lambda f: json.dump(data, f, ensure_ascii=False, indent=indent))
+
+
+def _atomic_write(path, write, binary=False):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path), suffix=".tmp", dir=directory)
+    try:
+        with (os.fdopen(fd, 'wb') if binary else os.fdopen(fd, 'w', encoding='utf-8')) as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp は 0600 で作るので、置き換える前に元のファイル（無ければ umask に従った値）の権限にそろえる
+        os.chmod(tmp_path, _file_mode(path))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def read_jsonl_tail(path, offset):
+    """
+    JSON Lines のファイルを offset バイト目から読む（ジャーナルと呼ばれた番号の履歴で共通）
+    書き込み途中の最後の行はまだ読まず、途中で落ちて壊れた行は捨てる
+    :return: (レコードのリスト, 次に読み始める offset)
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        chunk = f.read()
+    end = chunk.rfind(b"\n") + 1
+    records = []
+    for line in chunk[:end].splitlines():
+        try:
+            records.append(json.loads(line))
+        except json.JSONDecodeError:
+            continue
+    return records, offset + end
+
+
+def append_jsonl(path, records, offset):
+    """
+    レコードを JSON Lines で追記する（ジャーナルと呼ばれた番号の履歴で共通）
+    :param offset: 読み込み済みの位置。それより後ろに改行の無い行（他の書き手が途中で落ちた跡）があれば先に閉じる
+    :return: 書き込んだ後のファイルの末尾（次に読み始める offset）
+    """
+    lines = [json.dumps(record, ensure_ascii=False).encode('utf-8') + b"\n" for record in records]
+    with open(path, 'ab') as f:
+        if f.tell() > offset:
+            f.write(b"\n")
+        f.write(b"".join(lines))
+        return f.tell()
+
+
+def _file_mode(path):
+    """open(path, 'w') で作ったときと同じ権限"""
+    try:
+        return os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+def _identity(st):
+    """ファイルが作り直されたかどうかを見分けるための値"""
+    return (st.st_ino, st.st_dev)
+
+
+def replay(cards, records, card_from_dict, index=None):
+    """
+    ジャーナルのレコードをカードのリストに適用する
+    どのレコードも2回適用しても結果が変わらないので、
+    スナップショットの書き出し直後（ジャーナルを空にする前）に落ちても状態は壊れない
+    :param cards: カードのリスト（その場で更新する）
+    :param records: read が返すレコードのリスト
+    :param card_from_dict: to_dict 形式の辞書からカードを作る関数
+    :param index: NumberIndex（渡された場合は一緒に更新し、番号のマークにも使う）
+    """
+    if not records:
+        return cards  # 追記が無いとき（書き込みのたびに呼ばれる）はカード全体を調べない
+    known = {card.card_number for card in cards}
+    for record in records:
+        op = record['op']
+        if op == 'add':
+            card = card_from_dict(record['card'])
+            if card.card_number not in known:
+                cards.append(card)
+                known.add(card.card_number)
+                if index is not None:
+                    index.add_card(card)
+        elif op == 'delete':
+            for i, card in enumerate(cards):
+                if card.card_number == record['card_number']:
+                    del cards[i]
+                    known.discard(card.card_number)
+                    if index is not None:
+                        index.remove_card(card)
+                    break
+        elif op == 'call':
+            if index is not None:
+                touched = index.mark_number(record['number'])
+            else:
+                touched = [card for card in cards if card.mark_number(record['number'])]
+            for card in touched:
+                card.check_bingo()
+        elif op == 'retract':
+            if index is not None:
+                index.unmark_number(record['number'])
+            else:
+                for card in cards:
+                    card.unmark_number(record['number'])
+    return cards
+
+
+class _FileLock:
+    """プロセス間の排他ロック（同じプロセス内のスレッド間は threading.RLock で守る）"""
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            self._file = open(self.path, 'a+')
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            self._file.close()
+            self._file = None
+        self._thread_lock.release()
+
+
+class GameJournal:
+    def __init__(self, data_file, card_from_dict=None, snapshot_every=SNAPSHOT_EVERY):
+        """
+        :param data_file: スナップショットのファイル名（bingo_data_{access_id}.json）
+        :param card_from_dict: 他の書き手が追加したカードを作る関数（sync / locked で使う）
+        :param snapshot_every: スナップショットを書き出すレコード数
+        """
+        self.data_file = data_file
+        self.journal_file = f"{data_file}.journal"
+        self.binary_file = f"{data_file}.bcard"
+        self.card_from_dict = card_from_dict
+        self.snapshot_every = snapshot_every
+        self.index = None  # 設定されていれば他の書き手のレコードを取り込むときに一緒に更新する
+        # from_packed を持つカードのクラス。設定されていれば、読み込み直すときにバイナリのスナップショットを使う
+        self.binary_card_class = None
+        self.pending = 0  # 最後のスナップショット以降のレコード数
+        self.version = 0  # 取り込み済みの最新バージョン
+        self.snapshot_version = None  # 今のジャーナルの先頭にあるスナップショットのバージョン
+        self.offset = 0  # ジャーナルファイルのどこまで読んだか（バイト）
+        self.recent = deque(maxlen=KEEP_EVENTS)
+        self._identity = None
+        self._lock = _FileLock(f"{data_file}.lock")
+
+    def _stat(self):
+        try:
+            return os.stat(self.journal_file)
+        except FileNotFoundError:
+            return None
+
+    def _replaced(self):
+        """他の書き手がスナップショットを書き出してジャーナルを作り直したか"""
+        st = self._stat()
+        if st is None:
+            return self.offset > 0
+        return _identity(st) != self._identity or st.st_size < self.offset
+
+    def _read_tail(self):
+        """前回読んだ位置から後ろのレコードを読み、バージョンを振って返す"""
+        st = self._stat()
+        if st is None:
+            return []
+        self._identity = _identity(st)
+        lines, self.offset = read_jsonl_tail(self.journal_file, self.offset)
+        records = []
+        for record in lines:
+            if record['op'] == 'snapshot':
+                self.version = self.snapshot_version = record['version']
+                continue
+            self.version = record.setdefault('version', self.version + 1)
+            records.append(record)
+            self.recent.append(record)
+        self.pending += len(records)
+        return records
+
+    def read(self):
+        """
+        スナップショットとジャーナルの残りを最初から読み込む
+        :return: (スナップショットの辞書のリスト, レコードのリスト)
+        """
+        data = []
+        if os.path.exists(self.data_file):
+            with open(self.data_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        self._rewind()
+        return data, self._read_tail()
+
+    def read_binary(self):
+        """
+        JSONを読まずに、バイナリのスナップショット（{data_file}.bcard）とジャーナルの残りを読み込む
+        :return: (BinaryCardFile, レコードのリスト)。
+                 バイナリが無い・今のジャーナルのスナップショットと食い違う場合は None（read を使う）
+        """
+        if not os.path.exists(self.binary_file):
+            return None
+        # numpy はバイナリを読むときに初めて読み込む
+        from bingo_engine.binfile import BinaryCardFile
+        try:
+            binary = BinaryCardFile(self.binary_file)
+        except (ValueError, OSError):
+            return None
+        self._rewind()
+        records = self._read_tail()
+        if binary.journal_version != self.snapshot_version:
+            return None
+        return binary, records
+
+    def _rewind(self):
+        self.offset = 0
+        self.version = 0
+        self.snapshot_version = None
+        self.pending = 0
+        self.recent.clear()
+
+    def sync(self, cards):
+        """
+        他の書き手が追記したレコードだけを読み込んでカードに適用する
+        ジャーナルが作り直されていた場合はスナップショットから読み込み直す
+        :return: 取り込んだレコードのリスト
+        """
+        with self._lock._thread_lock:
+            if self._replaced():
+                binary = self.read_binary() if self.binary_card_class is not None else None
+                if binary is not None:
+                    snapshot, records = binary
+                    cards[:] = snapshot.to_cards(self.binary_card_class)
+                else:
+                    data, records = self.read()
+                    cards[:] = [self.card_from_dict(d) for d in data]
+                if self.index is not None:
+                    self.index.reset(cards)
+            else:
+                records = self._read_tail()
+            replay(cards, records, self.card_from_dict, self.index)
+            return records
+
+    @contextmanager
+    def locked(self, cards):
+        """
+        他のセッション・プロセスの書き込みを止めて、最新の状態に追いついてから処理する
+        with の中で重複チェックなどを行い、append で追記する
+        """
+        with self._lock:
+            self.sync(cards)
+            yield self
+
+    def events_since(self, version):
+        """
+        指定したバージョンより後のレコードを返す
+        :return: レコードのリスト。メモリ上に残っていないほど古い場合は None（読み込み直しが必要）
+        """
+        with self._lock._thread_lock:
+            if version >= self.version:
+                return []
+            if not self.recent or self.recent[0]['version'] > version + 1:
+                return None
+            return [record for record in self.recent if record['version'] > version]
+
+    def append(self, record, cards):
+        """
+        レコードを次のバージョンで1行追記する。溜まったらスナップショットを書き出す
+        :param cards: 現在のカードのリスト（追いつくためとスナップショット用）
+        :return: 追記したレコードのバージョン
+        """
+        return self.append_many([record], cards)
+
+    def append_many(self, records, cards):
+        """
+        複数のレコードを1回のロック・1回の書き込みでまとめて追記する（一括登録用）
+        :return: 最後に追記したレコードのバージョン
+        """
+        with METRICS.measure("persist", len(records)), self.locked(cards):
+            records = [dict(record, version=self.version + k + 1) for k, record in enumerate(records)]
+            self.offset = append_jsonl(self.journal_file, records, self.offset)
+            self._identity = _identity(os.stat(self.journal_file))
+            self.recent.extend(records)
+            self.version += len(records)
+            self.pending += len(records)
+            if self.pending >= self.snapshot_every:
+                self.compact(cards)
+            return self.version
+
+    def cards_added(self, new_cards, cards):
+        return self.append_many([{"op": "add", "card": card.to_dict()} for card in new_cards], cards)
+
+    def card_deleted(self, card_number, cards):
+        return self.append({"op": "delete", "card_number": card_number}, cards)
+
+    def number_called(self, number, cards):
+        return self.append({"op": "call", "number": number}, cards)
+
+    def number_retracted(self, number, cards):
+        return self.append({"op": "retract", "number": number}, cards)
+
+    def compact(self, cards):
+        """
+        現在のカード一覧をスナップショットとして書き出し、
+        ジャーナルを「このバージョンまではスナップショットに含まれる」という1行だけにする
+        """
+        with self._lock:
+            atomic_write_json(self.data_file, [card.to_dict() for card in cards])
+            # バイナリはジャーナルを作り直す前に書く（先頭のスナップショットと同じバージョンのときだけ使われる）
+            self._write_binary(cards)
+            header = json.dumps({"op": "snapshot", "version": self.version}) + "\n"
+            _atomic_write(self.journal_file, lambda f: f.write(header))
+            st = os.stat(self.journal_file)
+            self._identity = _identity(st)
+            self.offset = st.st_size
+            self.snapshot_version = self.version
+            self.pending = 0
+
+    def _write_binary(self, cards):
+        if len(cards) >= BINARY_SNAPSHOT_CARDS:
+            from bingo_engine.binfile import write_cards
+            try:
+                write_cards(self.binary_file, cards, journal_version=self.version)
+                return
+            except ValueError:
+                pass  # バイナリにできないカード番号（長すぎる・整数と文字列が混ざっている）はJSONだけにする
+        if os.path.exists(self.binary_file):
+            os.remove(self.binary_file)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+ビンゴラインの定義
+check_bingo が返す表示名と、bingo_lines に保存するキーはここで一元管理する
+
+@author: egumon
+"""
+
+def cells_mask(cells):
+    """
+    マスの集合を25bitマスクに変換する
+    マス(i, j) はビット i*5+j に対応する
+    """
+    mask = 0
+    for i, j in cells:
+        mask |= 1 << (i * 5 + j)
+    return mask
+
+def grid_key(numbers):
+    """
+    5x5の数字を25バイトの bytes にする（CompactBingoCard の持ち方と同じ）
+    同じ数字のカードを O(1) で見つけるためのキー。カード番号やマーク状態は含まない
+    1バイトに入らない数字（入力ミスの 610 など）があるときは tuple にする（bytes のキーとは一致しない）
+    """
+    flat = [n for row in numbers for n in row]
+    try:
+        return bytes(flat)
+    except ValueError:
+        return tuple(flat)
+
+# 12本のビンゴライン: (bingo_linesのキー, 表示名, マスのリスト)
+# 並び順は check_bingo がパターンを返す順番（横 → 縦 → 斜め）と同じ
+LINES = (
+    [(f"row_{i}", f"横{i+1}行目", [(i, j) for j in range(5)]) for i in range(5)]
+    + [(f"col_{j}", f"縦{j+1}列目", [(i, j) for i in range(5)]) for j in range(5)]
+    + [("diagonal1", "斜め（左上から右下）", [(i, i) for i in range(5)]),
+       ("diagonal2", "斜め（右上から左下）", [(i, 4-i) for i in range(5)])]
+)
+
+LINE_KEYS = [key for key, _, _ in LINES]
+LINE_LABELS = [label for _, label, _ in LINES]
+
+# (キー, 表示名, 25bitマスク)
+LINE_MASKS = [(key, label, cells_mask(cells)) for key, label, cells in LINES]
+
+FREE_MASK = cells_mask([(2, 2)])
+
+# マス(i, j) を通るラインの添字: CELL_LINES[i][j] -> [k, ...]（2〜4本）
+CELL_LINES = [
+    [[k for k, (_, _, cells) in enumerate(LINES) if (i, j) in cells] for j in range(5)]
+    for i in range(5)
+]
+
+# マス(i, j) を通るラインのマスクを LINES の添字付きで持つ: CELL_LINE_MASKS[i*5+j] -> [(k, mask), ...]
+CELL_LINE_MASKS = [
+    [(k, LINE_MASKS[k][2]) for k in CELL_LINES[i][j]] for i in range(5) for j in range(5)
+]
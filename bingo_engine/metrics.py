@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+処理時間の計測（読み込み・マーク・判定・保存・描画）
+処理ごとに回数・合計時間・p50/p95/最大と、1回あたりに扱ったカードの枚数を記録する
+計測を切っているあいだは何もしない共通のタイマーを返すだけなので、ほとんど負荷がかからない
+
+    with METRICS.measure("mark") as m:
+        touched = index.mark_number(number)
+        m.cards = len(touched)
+
+@author: egumon
+"""
+
+import csv
+import io
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# パーセンタイルの計算に使う直近の記録の件数（処理ごと）
+WINDOW = 1000
+
+COLUMNS = ["name", "count", "total_s", "mean_s", "p50_s", "p95_s", "max_s", "cards", "cards_per_call"]
+
+
+class _NullTimer:
+    """計測しないときのタイマー（cards を代入されても捨てる）"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ("metrics", "name", "cards", "start")
+
+    def __init__(self, metrics, name, cards):
+        self.metrics = metrics
+        self.name = name
+        self.cards = cards
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.name, time.perf_counter() - self.start, self.cards)
+        return False
+
+
+class _Stat:
+    __slots__ = ("count", "total", "max", "cards", "recent")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.cards = 0
+        self.recent = deque(maxlen=WINDOW)
+
+
+def _percentile(values, q):
+    # 線形補間（numpy.percentile の既定と同じ）
+    values = sorted(values)
+    pos = (len(values) - 1) * q
+    lo = int(pos)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+
+class Metrics:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def measure(self, name, cards=0):
+        """
+        with 文で囲んだ処理の時間を name の記録に足す
+        :param cards: 扱ったカードの枚数（あとから timer.cards に代入してもよい）
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name, cards)
+
+    def record(self, name, seconds, cards=0):
+        with self._lock:
+            stat = self._stats.get(name)
+            if stat is None:
+                stat = self._stats[name] = _Stat()
+            stat.count += 1
+            stat.total += seconds
+            stat.max = max(stat.max, seconds)
+            stat.cards += cards
+            stat.recent.append(seconds)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def summary(self):
+        """処理ごとの集計を COLUMNS の順の辞書のリストで返す（p50/p95 は直近 WINDOW 件から計算）"""
+        with self._lock:
+            stats = [(name, stat.count, stat.total, stat.max, stat.cards, list(stat.recent))
+                     for name, stat in self._stats.items()]
+        return [
+            {
+                "name": name,
+                "count": count,
+                "total_s": total,
+                "mean_s": total / count,
+                "p50_s": _percentile(recent, 0.5),
+                "p95_s": _percentile(recent, 0.95),
+                "max_s": max_s,
+                "cards": cards,
+                "cards_per_call": cards / count,
+            }
+            for name, count, total, max_s, cards, recent in sorted(stats)
+        ]
+
+    def to_json(self):
+        return json.dumps(self.summary(), ensure_ascii=False, indent=2)
+
+    def to_csv(self):
+        out = io.StringIO()
+        writer = csv.DictWriter(out, fieldnames=COLUMNS, lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(self.summary())
+        return out.getvalue()
+
+
+# プロセス全体で1つ。環境変数 BINGO_METRICS=1 で起動時から計測する
+METRICS = Metrics(enabled=os.environ.get("BINGO_METRICS", "") not in ("", "0"))
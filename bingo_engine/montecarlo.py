@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+モンテカルロ法による「次にビンゴになりそうなカード」の推定
+まだ呼ばれていない番号の出る順番をたくさんサンプリングし、
+サンプルごとに各カードが何番目の番号で初めてビンゴになるかを求めて、
+k回以内にビンゴになる確率と、ビンゴまでの回数の期待値を推定する
+
+最初のサンプリングはプロセスプールで並列に行う。
+番号が呼ばれた後は、一様な順列から1つの番号を取り除いたものも一様な順列なので、
+同じサンプルを使い回して差分だけ更新する:
+    その番号を持たないカード ... 初ビンゴの回数が呼ばれた番号より後なら1減らすだけ
+    その番号を持つカード     ... そのカードだけ計算し直す
+
+@author: egumon
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from bingo_engine.lines import LINES
+
+# 既定のサンプル数
+SAMPLES = 2000
+# サンプルはこの件数ずつのかたまりに分け、かたまりごとに乱数の種を決める
+# （ワーカー数を変えても同じ種なら同じ結果になる）
+CHUNK_SAMPLES = 250
+# (25 x カード枚数 x サンプル数) の一時配列をこの要素数以下に抑える
+_MAX_CELLS = 4_000_000
+
+# (12, 5): 各ラインのマスの通し番号 i*5+j
+_LINE_CELLS = np.array([[i * 5 + j for i, j in cells] for _, _, cells in LINES])
+
+
+def first_bingo_times(ranks, numbers, marked):
+    """
+    各カード・各サンプルについて、何番目に呼ばれる番号で初めてビンゴになるかを求める
+    :param ranks: (S, 76) 番号ごとの呼ばれる順番（1始まり）。呼ばれ済みの番号と 0（FREE）は 0
+    :param numbers: (N, 25) カードの数字
+    :param marked: (N, 25) マーク状態
+    :return: (N, S) の int8。既にビンゴのカードは 0
+    """
+    samples, n = len(ranks), len(numbers)
+    times = np.empty((n, samples), dtype=np.int8)
+    by_number = np.ascontiguousarray(ranks.T)  # (76, S)
+    step = max(1, _MAX_CELLS // max(1, samples * 25))
+    for start in range(0, n, step):
+        stop = min(n, start + step)
+        cells = by_number[numbers[start:stop].T]  # (25, n, S)
+        cells[marked[start:stop].T] = 0
+        # ラインが埋まるのはラインの中で一番最後に呼ばれるマスのとき、カードは一番早く埋まるライン
+        first = None
+        for line in _LINE_CELLS:
+            line_max = cells[line[0]].copy()
+            for cell in line[1:]:
+                np.maximum(line_max, cells[cell], out=line_max)
+            first = line_max if first is None else np.minimum(first, line_max, out=first)
+        times[start:stop] = first
+    return times
+
+
+def _ranks_for(orders):
+    """(S, R) の出る順番から (S, 76) の順位表を作る"""
+    samples = len(orders)
+    ranks = np.zeros((samples, 76), dtype=np.int8)
+    positions = np.arange(1, orders.shape[1] + 1, dtype=np.int8)
+    ranks[np.arange(samples)[:, None], orders] = positions
+    return ranks
+
+
+def _simulate_chunk(seed, samples, remaining, numbers, marked):
+    """1かたまり分のサンプリング（プロセスプールのワーカーで実行される）"""
+    rng = np.random.default_rng(seed)
+    orders = rng.permuted(np.tile(remaining, (samples, 1)), axis=1)
+    ranks = _ranks_for(orders)
+    return ranks, first_bingo_times(ranks, numbers, marked)
+
+
+class WinProbabilityEstimator:
+    def __init__(self, card_numbers, numbers, marked, called=(), samples=SAMPLES, seed=0, workers=None):
+        """
+        :param card_numbers: カード番号のリスト
+        :param numbers: (N, 5, 5) の数字
+        :param marked: (N, 5, 5) のマーク状態
+        :param called: 既に呼ばれた番号
+        :param samples: サンプル数
+        :param seed: 乱数の種（同じ種・同じ入力なら同じ結果）
+        :param workers: プロセス数（None は CPU 数、1 ならプロセスを使わない）
+        """
+        self.card_numbers = list(card_numbers)
+        n = len(self.card_numbers)
+        self.numbers = np.asarray(numbers, dtype=np.intp).reshape(n, 25)
+        self.marked = np.array(marked, dtype=bool).reshape(n, 25)
+        self.called = set(called)
+        self.samples = samples
+        self.seed = seed
+        self.workers = workers
+        self.ranks, self.times = self._simulate()
+
+    @classmethod
+    def from_cards(cls, cards, called=(), **kwargs):
+        """BingoCard / CompactBingoCard のリストから作る（マーク済みの番号は呼ばれ済みとみなす）"""
+        numbers = [card.numbers for card in cards]
+        marked = [card.marked for card in cards]
+        called = set(called)
+        for card_numbers, card_marked in zip(numbers, marked):
+            for i in range(5):
+                for j in range(5):
+                    if card_marked[i][j] and card_numbers[i][j]:
+                        called.add(card_numbers[i][j])
+        return cls([card.card_number for card in cards], numbers, marked, called, **kwargs)
+
+    def remaining_numbers(self):
+        return np.array([n for n in range(1, 76) if n not in self.called], dtype=np.intp)
+
+    def _simulate(self):
+        remaining = self.remaining_numbers()
+        chunks = []
+        for k, seed in enumerate(np.random.SeedSequence(self.seed).spawn(-(-self.samples // CHUNK_SAMPLES))):
+            chunks.append((seed, min(CHUNK_SAMPLES, self.samples - k * CHUNK_SAMPLES)))
+        args = [(seed, size, remaining, self.numbers, self.marked) for seed, size in chunks]
+        if self.workers == 1 or len(chunks) == 1:
+            results = [_simulate_chunk(*a) for a in args]
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                results = list(pool.map(_simulate_chunk, *zip(*args)))
+        ranks = np.concatenate([r for r, _ in results])
+        times = np.concatenate([t for _, t in results], axis=1)
+        return ranks, times
+
+    def refresh(self):
+        """最初からサンプリングし直す（カードの追加・削除の後など）"""
+        self.ranks, self.times = self._simulate()
+
+    def call(self, number):
+        """
+        呼ばれた番号を反映する（サンプルを使い回して差分だけ更新する）
+        """
+        if number in self.called or not 1 <= number <= 75:
+            return
+        self.called.add(number)
+        position = self.ranks[:, number].copy()  # 各サンプルでこの番号が何番目だったか
+        self.ranks -= (self.ranks > position[:, None])
+        self.ranks[:, number] = 0
+
+        hit = self.numbers == number
+        affected = hit.any(axis=1)
+        self.times -= (self.times > position[None, :]) & ~affected[:, None]
+        if affected.any():
+            self.marked |= hit
+            self.times[affected] = first_bingo_times(self.ranks, self.numbers[affected], self.marked[affected])
+
+    def add_cards(self, card_numbers, numbers, marked):
+        """カードを追加する（追加したカードだけ、今のサンプルで計算する）"""
+        n = len(card_numbers)
+        numbers = np.asarray(numbers, dtype=np.intp).reshape(n, 25)
+        marked = np.array(marked, dtype=bool).reshape(n, 25)
+        self.card_numbers.extend(card_numbers)
+        self.numbers = np.concatenate([self.numbers, numbers])
+        self.marked = np.concatenate([self.marked, marked])
+        self.times = np.concatenate([self.times, first_bingo_times(self.ranks, numbers, marked)])
+
+    def remove_card(self, card_number):
+        i = self.card_numbers.index(card_number)
+        del self.card_numbers[i]
+        self.numbers = np.delete(self.numbers, i, axis=0)
+        self.marked = np.delete(self.marked, i, axis=0)
+        self.times = np.delete(self.times, i, axis=0)
+
+    def probability_within(self, k):
+        """各カードが次の k 回以内にビンゴになる確率 (N,)"""
+        return (self.times <= k).mean(axis=1)
+
+    def expected_draws(self):
+        """各カードが初めてビンゴになるまでの回数の期待値 (N,)。既にビンゴなら 0"""
+        return self.times.mean(axis=1)
+
+    def ranking(self, k, top=10):
+        """
+        まだビンゴになっていないカードを、k 回以内にビンゴになる確率が高い順に並べる
+        :return: [(カード番号, 確率, 期待回数), ...]
+        """
+        probability = self.probability_within(k)
+        expected = self.expected_draws()
+        order = np.lexsort((expected, -probability))
+        order = order[expected[order] > 0][:top]
+        return [(self.card_numbers[i], float(probability[i]), float(expected[i])) for i in order]
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+特別な形（スペシャルラウンド）の当たり判定
+四隅・X・外枠・ブラックアウト・文字の形などを 5x5 の図（#=必要なマス、.=不要なマス）で定義し、
+ゲームごとに選んだ形を、マークされたカード全部に対して一度の配列演算でまとめて判定する
+形をいくつ増やしても、1回の判定は (カード枚数, 形の数) の AND 比較1回で済む
+一度揃った形は、通常のラインの bingo_lines と同じく二度は報告しない
+numpy は形を選んで判定するときに初めて読み込む（形を選ばないゲームでは不要なので）
+
+@author: egumon
+"""
+
+from collections import namedtuple
+
+from bingo_engine.lines import cells_mask
+
+# 1つのゲームで同時に選べる形の数（揃った形を64bit整数のビットで覚えるため）
+MAX_PATTERNS = 63
+
+Pattern = namedtuple("Pattern", ["key", "label", "mask"])
+
+
+def parse_pattern(key, label, text):
+    """
+    5行の図から形を作る
+    :param text: 5行 x 5文字。"#", "o", "1" が必要なマス、".", "_", "0" が不要なマス（空白は無視）
+    :raises ValueError: 図が 5x5 でない、または必要なマスが1つもない場合
+    """
+    rows = [row.replace(" ", "") for row in text.strip().splitlines() if row.strip()]
+    if len(rows) != 5 or any(len(row) != 5 for row in rows):
+        raise ValueError("形は5行 x 5文字で書いてください")
+    cells = []
+    for i, row in enumerate(rows):
+        for j, ch in enumerate(row):
+            if ch in "#o1":
+                cells.append((i, j))
+            elif ch not in "._0":
+                raise ValueError(f"使えない文字です: {ch}")
+    if not cells:
+        raise ValueError("必要なマスが1つもありません")
+    return Pattern(key, label, cells_mask(cells))
+
+
+# 組み込みの形: (キー, 表示名, 図)
+_BUILTIN = [
+    ("four_corners", "四隅", "#...#/...../...../...../#...#"),
+    ("x", "X（両対角線）", "#...#/.#.#./..#../.#.#./#...#"),
+    ("plus", "十字", "..#../..#../#####/..#../..#.."),
+    ("frame", "外枠", "#####/#...#/#...#/#...#/#####"),
+    ("inner_frame", "内枠", "...../.###./.#.#./.###./....."),
+    ("blackout", "ブラックアウト（全部）", "#####/#####/#####/#####/#####"),
+    ("letter_t", "Tの字", "#####/..#../..#../..#../..#.."),
+    ("letter_l", "Lの字", "#..../#..../#..../#..../#####"),
+    ("letter_b", "Bの字", "####./#...#/####./#...#/####."),
+    ("letter_i", "Iの字", "#####/..#../..#../..#../#####"),
+    ("letter_n", "Nの字", "#...#/##..#/#.#.#/#..##/#...#"),
+    ("letter_g", "Gの字", ".####/#..../#..##/#...#/.###."),
+    ("letter_o", "Oの字", ".###./#...#/#...#/#...#/.###."),
+]
+
+# キー -> Pattern（表示・選択の順番はこの並び）
+PATTERNS = {key: parse_pattern(key, label, art.replace("/", "\n")) for key, label, art in _BUILTIN}
+
+
+def card_masks(cards):
+    """カード（BingoCard / CompactBingoCard）のマーク状態を25bit整数の配列にする"""
+    import numpy as np
+    return np.fromiter((card.mask for card in cards), dtype=np.uint32, count=len(cards))
+
+
+class PatternChecker:
+    """
+    選ばれた形をまとめて判定する
+    揃った形はカード番号ごとのビット（self.patterns の添字）で覚え、新しく揃ったものだけを返す
+    マークを取り消して揃わなくなった形は、次の判定で覚えていた印も外す
+    """
+    def __init__(self, patterns=()):
+        patterns = list(patterns)
+        if len(patterns) > MAX_PATTERNS:
+            raise ValueError(f"同時に選べる形は {MAX_PATTERNS} 個までです")
+        self.patterns = patterns
+        self.masks = self._weights = None
+        if patterns:
+            import numpy as np
+            self.masks = np.array([p.mask for p in patterns], dtype=np.uint32)
+            self._weights = np.left_shift(np.int64(1), np.arange(len(patterns), dtype=np.int64))
+        self.won = {}  # カード番号 -> 揃ったことを報告済みの形のビット
+
+    def __bool__(self):
+        return bool(self.patterns)
+
+    def evaluate(self, masks):
+        """
+        :param masks: (n,) の25bitマーク状態（card_masks や CardStore.masks の結果）
+        :return: (n, 形の数) の bool 配列。列の並びは self.patterns と同じ
+        """
+        import numpy as np
+        masks = np.asarray(masks, dtype=np.uint32)
+        return (masks[:, None] & self.masks) == self.masks
+
+    def _full_bits(self, masks):
+        return self.evaluate(masks) @ self._weights
+
+    def check(self, cards):
+        """
+        マーク状態が変わったカードだけを判定する
+        :return: 新しく形が揃ったカードの [(card, [表示名, ...]), ...]
+        """
+        if not self.patterns or not cards:
+            return []
+        results = []
+        for card, full in zip(cards, self._full_bits(card_masks(cards)).tolist()):
+            won = self.won.get(card.card_number, 0) & full
+            new = full & ~won
+            self.won[card.card_number] = won | new
+            if new:
+                results.append((card, [p.label for k, p in enumerate(self.patterns) if new >> k & 1]))
+        return results
+
+    def reset(self, cards):
+        """今揃っている形を報告済みとして覚え直す（形を選び直したとき・読み込み直したとき）"""
+        self.won = {}
+        if self.patterns and cards:
+            for card, full in zip(cards, self._full_bits(card_masks(cards)).tolist()):
+                if full:
+                    self.won[card.card_number] = full
+
+    def forget(self, card_number):
+        self.won.pop(card_number, None)
+
+    def winners(self, masks, card_numbers):
+        """
+        今それぞれの形が揃っているカードを調べる
+        :return: [(表示名, [カード番号, ...]), ...]（揃っているカードがある形だけ）
+        """
+        if not self.patterns or not len(card_numbers):
+            return []
+        hits = self.evaluate(masks)
+        return [
+            (pattern.label, [card_numbers[n] for n in hits[:, k].nonzero()[0]])
+            for k, pattern in enumerate(self.patterns)
+            if hits[:, k].any()
+        ]
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+リーチ（あと1つでビンゴ）のカードを常に最新に保つ掲示板
+カードごとに「ビンゴまであと何マスか」を持ち、その値ごとのバケツにカードを入れておく
+さらに、まだ呼ばれていない番号ごとに「その番号が出ればビンゴになるカード」の逆引きを持つ
+番号が呼ばれたときは、その番号でマークされたカードだけを更新すればよい
+
+@author: egumon
+"""
+
+from bingo_engine.lines import LINES, cells_mask
+
+
+def card_number_key(card_number):
+    """整数と文字列のカード番号が混ざっていても並べられるようにするソートキー"""
+    return (isinstance(card_number, str), card_number)
+
+
+# ラインごとの25bitマスク（LINES と同じ並び）
+_LINE_BITS = [cells_mask(cells) for _, _, cells in LINES]
+
+
+def _evaluate(card):
+    """
+    カードのマーク状態（25bitの mask）と左上から横方向に並んだ数字（grid_key）から計算する
+    :return: (ビンゴまでのマス数, その番号が出ればビンゴになる番号の集合)
+    """
+    unmarked, flat = ~card.mask, card.grid_key
+    distance = 5
+    finishing = set()
+    for line_bits in _LINE_BITS:
+        open_cells = line_bits & unmarked
+        left = bin(open_cells).count("1")
+        if left < distance:
+            distance = left
+        if left == 1:
+            finishing.add(flat[open_cells.bit_length() - 1])
+    if distance != 1:
+        return distance, frozenset()  # 既にビンゴのカードとまだ遠いカードは「ビンゴになる番号」に載せない
+    # 同じ数字・同じマーク状態のカードで使い回すので、書き換えられない集合にする
+    return distance, frozenset(finishing)
+
+
+class ReachBoard:
+    def __init__(self, cards=()):
+        self.distance = {}  # カード番号 -> ビンゴまでのマス数（ビンゴ済みは 0）
+        self.buckets = [set() for _ in range(6)]  # マス数 -> カード番号の集合
+        self.finishing = {}  # カード番号 -> その番号が出ればビンゴになる番号の集合
+        self.winning_numbers = {}  # 番号 -> その番号が出ればビンゴになるカード番号の集合
+        for card in cards:
+            self.update(card)
+
+    def update(self, card):
+        """カードのマーク状態が変わったときに呼ぶ（そのカードの分だけ計算し直す）"""
+        self._set(card.card_number, *_evaluate(card))
+
+    def update_cards(self, cards):
+        """
+        マーク状態が変わったカードをまとめて更新する
+        同じ数字・同じマーク状態のカード（grid_key と mask が同じ）は結果も同じなので1回だけ計算する
+        """
+        results = {}
+        for card in cards:
+            key = (card.grid_key, card.mask)
+            result = results.get(key)
+            if result is None:
+                result = results[key] = _evaluate(card)
+            self._set(card.card_number, *result)
+
+    def update_marked(self, marks):
+        """
+        マスをマークしたカードを更新する（マークしたマスを通るラインだけを数え直す）
+        マークしてもラインの残りマス数は減るだけなので、ビンゴまでのマス数は前の値と数え直したラインの小さい方になり、
+        その番号が出ればビンゴになる番号も前からのものに数え直したラインの分を足すだけでよい
+        :param marks: [(同じ数字のカードのリスト, マークしたマスを通るラインの添字), ...]（NumberIndex.mark_number が作る）
+        """
+        distances, finishings = self.distance, self.finishing
+        empty = frozenset()
+        for cards, lines in marks:
+            last_mask = None
+            for card in cards:
+                card_number = card.card_number
+                old = distances.get(card_number)
+                if old is None:
+                    self.update(card)
+                    continue
+                if card.mask != last_mask:
+                    # 同じ数字・同じマーク状態のカードは結果も同じなので1回だけ計算する
+                    last_mask = card.mask
+                    unmarked, flat = ~last_mask, card.grid_key
+                    distance = old
+                    finishing = None
+                    for k in lines:
+                        open_cells = _LINE_BITS[k] & unmarked
+                        left = bin(open_cells).count("1")
+                        if left < distance:
+                            distance = left
+                        if left == 1:
+                            if finishing is None:
+                                finishing = set(finishings.get(card_number, ()))
+                            finishing.add(flat[open_cells.bit_length() - 1])
+                    if distance != 1:
+                        finishing = empty
+                    elif finishing is None:
+                        finishing = finishings.get(card_number, empty)
+                    else:
+                        finishing = frozenset(finishing)
+                if distance == old and finishing == finishings.get(card_number, empty):
+                    continue  # ほとんどのカードはリーチにもならないので、バケツを触らずに済ませる
+                self._set(card_number, distance, finishing)
+
+    def _set(self, card_number, distance, finishing):
+        self.remove(card_number)
+        self.distance[card_number] = distance
+        self.buckets[distance].add(card_number)
+        if finishing:
+            self.finishing[card_number] = finishing
+            for number in finishing:
+                self.winning_numbers.setdefault(number, set()).add(card_number)
+
+    def remove(self, card_number):
+        distance = self.distance.pop(card_number, None)
+        if distance is None:
+            return
+        self.buckets[distance].discard(card_number)
+        for number in self.finishing.pop(card_number, ()):
+            cards = self.winning_numbers[number]
+            cards.discard(card_number)
+            if not cards:
+                del self.winning_numbers[number]
+
+    def cards_at(self, distance):
+        """ビンゴまであと distance マスのカード番号"""
+        return self.buckets[distance]
+
+    def reach_cards(self):
+        """リーチのカード番号"""
+        return self.buckets[1]
+
+    def numbers_to_win(self):
+        """
+        まだ呼ばれていない番号のうち、出ればビンゴになるカードがあるもの
+        :return: [(番号, [カード番号, ...]), ...]（ビンゴになるカードが多い順）
+        """
+        return sorted(
+            ((number, sorted(cards, key=card_number_key)) for number, cards in self.winning_numbers.items()),
+            key=lambda item: (-len(item[1]), item[0]),
+        )
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+アクセスIDごとに読み込んだゲームをプロセス内で共有するレジストリ
+同じアクセスIDを見ている複数のセッションは、読み込み1回・メモリ上のコピー1つを共有する
+参照されていないゲームは、件数・カード枚数の上限を超えたら古い順（LRU）に捨てる
+元のファイルが外から書き換えられた場合は、次に取り出したときに差分を取り込むか読み込み直す
+
+レジストリのロックは一覧の出し入れの間だけ持ち、ゲームの読み込み・差分の取り込み（game.lock を取る）は
+ゲームごとのロックで行う。ゲームを書き換えている途中のスレッドが note_write でレジストリのロックを待っても、
+他のゲームや同じゲームの読み込みと互いに待ち合わせにならない
+
+@author: egumon
+"""
+
+import os
+import threading
+import weakref
+from collections import OrderedDict
+
+# 既定の上限
+MAX_ENTRIES = 16
+MAX_CARDS = 200_000
+
+
+def _file_signature(paths):
+    signature = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            signature.append((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+
+class _Entry:
+    __slots__ = ("value", "refs", "signature", "size", "lock")
+
+    def __init__(self):
+        self.value = None  # まだ読み込んでいない
+        self.refs = 0
+        self.signature = None
+        self.size = 0
+        self.lock = threading.Lock()  # このゲームの読み込み・差分の取り込みを1つずつ行う
+
+
+class Lease:
+    """
+    セッションがゲームを使っている間保持する参照
+    release を呼ぶか、このオブジェクトが破棄される（セッション終了）と参照カウントが減る
+    """
+    def __init__(self, registry, access_id):
+        self.registry = registry
+        self.access_id = access_id
+        self._finalizer = weakref.finalize(self, registry.release, access_id)
+
+    @property
+    def game(self):
+        return self.registry.get(self.access_id)
+
+    def release(self):
+        self._finalizer()
+
+
+class GameRegistry:
+    def __init__(self, loader, watch_files=None, max_entries=MAX_ENTRIES, max_cards=MAX_CARDS):
+        """
+        :param loader: アクセスIDを受け取ってゲームを読み込む関数。ゲームは len() でカード枚数を返すこと
+        :param watch_files: アクセスIDを受け取って、変更を監視するファイルのリストを返す関数
+        :param max_entries: 保持するゲーム数の上限
+        :param max_cards: 保持するカード枚数の合計の上限（メモリ量の目安）
+        """
+        self.loader = loader
+        self.watch_files = watch_files or (lambda access_id: [])
+        self.max_entries = max_entries
+        self.max_cards = max_cards
+        self._entries = OrderedDict()  # access_id -> _Entry（古い順）
+        self._lock = threading.RLock()
+        self.loads = 0
+
+    def _load(self, access_id, entry):
+        signature = _file_signature(self.watch_files(access_id))
+        self.loads += 1
+        entry.value = self.loader(access_id)
+        entry.signature = signature
+        entry.size = len(entry.value)
+
+    def _refresh(self, access_id, entry):
+        """entry.lock を持ち、レジストリのロックは持たずに呼ぶ"""
+        if entry.value is None:
+            self._load(access_id, entry)
+            return
+        signature = _file_signature(self.watch_files(access_id))
+        if entry.signature != signature:
+            # 他のプロセスなどがファイルを書き換えた。差分を取り込めるゲームは差分だけ取り込み、
+            # それ以外は読み込み直す（参照カウントは同じ entry に残る）
+            sync = getattr(entry.value, "sync", None)
+            if entry.signature is not None and sync is not None and sync():
+                entry.signature = signature
+                entry.size = len(entry.value)
+            else:
+                self._load(access_id, entry)
+
+    def _entry(self, access_id, refs=0):
+        """
+        :param refs: 参照カウントに足す数（取り出しと同じロックの中で足す）
+        """
+        with self._lock:
+            entry = self._entries.get(access_id)
+            if entry is None:
+                entry = self._entries[access_id] = _Entry()
+            entry.refs += refs
+            self._entries.move_to_end(access_id)
+        try:
+            with entry.lock:
+                self._refresh(access_id, entry)
+        except BaseException:
+            with self._lock:
+                entry.refs -= refs
+                if entry.value is None and self._entries.get(access_id) is entry:
+                    del self._entries[access_id]  # 読み込めなかったものは残さない
+            raise
+        with self._lock:
+            self._evict()
+        return entry
+
+    def get(self, access_id):
+        """ゲームを取り出す（無ければ読み込み、ファイルが変わっていれば読み込み直す）"""
+        return self._entry(access_id).value
+
+    def lease(self, access_id):
+        """ゲームを読み込み、参照カウントを1増やした Lease を返す"""
+        self._entry(access_id, refs=1)
+        return Lease(self, access_id)
+
+    def release(self, access_id):
+        with self._lock:
+            entry = self._entries.get(access_id)
+            if entry is not None and entry.refs > 0:
+                entry.refs -= 1
+            self._evict()
+
+    def note_write(self, access_id):
+        """
+        このプロセス自身がファイルを書いた後に呼ぶ
+        メモリ上のゲームは既に最新なので、読み込み直さないように監視情報だけを更新する
+        """
+        with self._lock:
+            entry = self._entries.get(access_id)
+            if entry is not None and entry.value is not None:
+                entry.signature = _file_signature(self.watch_files(access_id))
+                entry.size = len(entry.value)
+
+    def invalidate(self, access_id):
+        """次に取り出したときに必ず読み込み直すようにする"""
+        with self._lock:
+            entry = self._entries.get(access_id)
+            if entry is not None:
+                entry.signature = None
+
+    def _evict(self):
+        total = sum(entry.size for entry in self._entries.values())
+        for access_id in list(self._entries):
+            if len(self._entries) <= self.max_entries and total <= self.max_cards:
+                break
+            entry = self._entries[access_id]
+            if entry.refs == 0 and entry.value is not None:  # 読み込み中のものは残す
+                del self._entries[access_id]
+                total -= entry.size
+
+    def stats(self):
+        """{access_id: (参照数, カード枚数)} を古い順に返す"""
+        with self._lock:
+            return {access_id: (entry.refs, entry.size) for access_id, entry in self._entries.items()}
@@ -0,0 +1,476 @@
+# -*- coding: utf-8 -*-
+"""
+ローカルの HTTP/JSON ゲームサービス（Streamlit の画面とは別に、抽選機・表示ボード・スクリプトから使う）
+標準ライブラリの asyncio だけで動き、アクセスIDごとのゲームを同時にいくつでも扱える
+ゲームは Streamlit の画面と同じファイル（bingo_data_{アクセスID}.json とジャーナル）を読み書きするので、
+サービスで呼んだ番号は画面にも、画面で呼んだ番号はサービスにも反映される
+
+    GET    /games/{id}                  状態（カード枚数・呼ばれた番号・ビンゴ/リーチの枚数）
+    POST   /games/{id}/cards            カードの一括登録
+                                        JSON: {"cards": [{"card_number": ..., "numbers": 5x5}, ...]}
+                                        Content-Type が text/csv / application/x-ndjson なら一括登録と同じ形式
+    DELETE /games/{id}/cards/{番号}     カードの削除
+    POST   /games/{id}/calls            番号を呼ぶ {"number": 12} または {"numbers": [12, 34, ...]}
+    DELETE /games/{id}/calls/{番号}     呼んだ番号の取り消し
+    GET    /games/{id}/winners          ビンゴになったカードとライン
+    GET    /games/{id}/reach            リーチのカードと、出ればビンゴになる番号
+    GET    /games/{id}/patterns         選んでいる特別な形と、選べる形（組み込み + 自作）
+    POST   /games/{id}/patterns         特別な形を選び直す {"patterns": [キー, ...]}
+                                        自作の形の追加 {"custom": [{"label": 名前, "art": 5行 x 5文字の図}, ...]}
+                                        （追加した形は選んでいる形に加わる。画面の「🧩 特別な形」と共有）
+    GET    /games/{id}/changes?since=V  バージョン V より後の変更（ジャーナルのレコード）だけ
+                                        古すぎて残っていない場合は 410（GET /games/{id} から読み込み直す）
+    GET    /games/{id}/events           Server-Sent Events（call / bingo / pattern / retract）
+                                        呼ばれた番号の履歴から作るので、画面や他のプロセスで呼んだ番号も届く
+
+    python -m bingo_engine.server --port 8765
+
+@author: egumon
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import re
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from bingo_engine.game import load_shared_game, watch_files_for
+from bingo_engine.importer import import_cards
+from bingo_engine.patterns import PATTERNS, parse_pattern
+from bingo_engine.reach import card_number_key
+from bingo_engine.registry import GameRegistry
+
+HOST = "127.0.0.1"
+PORT = 8765
+
+# アクセスIDはファイル名になるので半角英数字と - _ だけ
+ACCESS_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+MAX_BODY = 64 * 1024 * 1024
+# 購読者ごとに溜めておけるイベント数（読むのが遅い購読者は切断する）
+SUBSCRIBER_BUFFER = 10_000
+# SSE の接続を保つためのコメントを送る間隔（秒）
+HEARTBEAT = 15
+# 購読者がいるあいだ、他の書き手（画面・他のプロセス）が呼んだ番号を履歴から拾いに行く間隔（秒）
+FOLLOW_INTERVAL = 0.5
+
+_REASONS = {
+    200: "OK", 204: "No Content", 400: "Bad Request", 404: "Not Found",
+    405: "Method Not Allowed", 410: "Gone", 413: "Payload Too Large", 500: "Internal Server Error",
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class _Subscriber:
+    def __init__(self):
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_BUFFER)
+        self.closed = False
+
+
+def _parse_number(value):
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, int) or not 1 <= value <= 75:
+        raise HTTPError(400, f"番号は1から75の整数で指定してください: {value!r}")
+    return value
+
+
+class BingoService:
+    def __init__(self, registry=None):
+        self.registry = registry or GameRegistry(load_shared_game, watch_files=watch_files_for)
+        self.subscribers = {}  # アクセスID -> _Subscriber の集合
+        self.cursors = {}  # アクセスID -> 配信済みの履歴のレコード数
+        self.followers = {}  # アクセスID -> 履歴を見に行くタスク
+
+    # ---- ゲームの操作（スレッドで実行する。同じゲームへの操作は game.lock で順番に行う）----
+
+    def register(self, access_id, body, content_type):
+        game = self.registry.get(access_id)
+        if content_type.startswith("text/csv"):
+            stream, fmt = io.StringIO(body.decode("utf-8-sig")), "csv"
+        elif content_type.startswith(("application/x-ndjson", "application/jsonl")):
+            stream, fmt = io.StringIO(body.decode("utf-8-sig")), "jsonl"
+        else:
+            cards = _load_json(body).get("cards")
+            if not isinstance(cards, list):
+                raise HTTPError(400, "cards にカードのリストを指定してください")
+            stream = io.StringIO("\n".join(json.dumps(card, ensure_ascii=False) for card in cards))
+            fmt = "jsonl"
+        with game.transaction():
+            report = import_cards(stream, fmt, existing=game.number_index.cards_by_number,
+                                  grids=game.number_index.grids)
+            added = game.add_cards([card_number for card_number, _ in report.cards],
+                                   [numbers for _, numbers in report.cards])
+        if added:
+            self.registry.note_write(access_id)  # game.lock を放してから（レジストリのロックと逆順に取らない）
+        return {
+            "added": [card.card_number for card in added],
+            "rejected": [{"line": line, "card_number": card_number, "reason": reason}
+                         for line, card_number, reason in report.rejected],
+            "duplicates": [{"line": line, "card_number": card_number, "same_as": same_as}
+                           for line, card_number, same_as in report.duplicates],
+        }
+
+    def delete_card(self, access_id, card_number):
+        game = self.registry.get(access_id)
+        with game.lock:
+            # パスのカード番号は文字列なので、数字で登録されたカードとも比べられるように文字列で探す
+            card = next((card for card in game.cards if str(card.card_number) == card_number), None)
+            if card is None or not game.delete_card(card.card_number):
+                raise HTTPError(404, f"カード No.{card_number} は登録されていません")
+        self.registry.note_write(access_id)
+        return {"deleted": card.card_number}
+
+    def call(self, access_id, numbers):
+        """番号をまとめて呼ぶ（イベントは履歴から配信する）"""
+        game = self.registry.get(access_id)
+        results = []
+        wrote = False
+        with game.lock:
+            for number in numbers:
+                result = game.play(number)
+                if result is None:
+                    results.append({"number": number, "already_called": True})
+                    continue
+                touched, bingos, pattern_results = result
+                wrote = True
+                bingo = [{"card_number": card.card_number, "lines": lines} for card, lines in bingos]
+                patterns = [{"card_number": card.card_number, "patterns": labels} for card, labels in pattern_results]
+                results.append({"number": number, "marked": len(touched), "bingo": bingo, "patterns": patterns})
+            called = list(game.called)
+        if wrote:
+            self.registry.note_write(access_id)
+        return {"results": results, "called": called}
+
+    def retract(self, access_id, number):
+        game = self.registry.get(access_id)
+        with game.transaction():
+            if number not in game.called:
+                raise HTTPError(404, f"番号 {number} はまだ呼ばれていません")
+            touched = game.retract(number)
+        self.registry.note_write(access_id)
+        return {"number": number, "unmarked": len(touched)}
+
+    def state(self, access_id):
+        game = self.registry.get(access_id)
+        with game.lock:
+            reach = game.number_index.reach
+            return {
+                "access_id": access_id,
+                "cards": len(game),
+                "called": list(game.called),
+                "draws": game.history.draws if game.history is not None else None,
+                "bingo_cards": sum(1 for card in game.cards if card.bingo_lines),
+                "reach_cards": len(reach.reach_cards()),
+                "patterns": [pattern.label for pattern in game.patterns.patterns],
+                "version": game.journal.version if game.journal is not None else None,
+            }
+
+    def patterns(self, access_id):
+        game = self.registry.get(access_id)
+        with game.lock:
+            return _patterns_response(game)
+
+    def set_patterns(self, access_id, request):
+        """自作の形を追加してから、patterns があれば選び直す（画面と同じくキーは custom_{名前}）"""
+        custom = request.get("custom", [])
+        keys = request.get("patterns")
+        if not isinstance(custom, list) or any(not isinstance(d, dict) for d in custom):
+            raise HTTPError(400, "custom には label と art を持つオブジェクトのリストを指定してください")
+        if keys is not None and (not isinstance(keys, list) or any(not isinstance(key, str) for key in keys)):
+            raise HTTPError(400, "patterns には形のキーのリストを指定してください")
+        new_patterns = []
+        for d in custom:
+            label = d.get("label")
+            if not isinstance(label, str) or not label.strip() or not isinstance(d.get("art"), str):
+                raise HTTPError(400, "自作の形には label（名前）と art（5行 x 5文字の図）を指定してください")
+            try:
+                new_patterns.append(parse_pattern(f"custom_{label.strip()}", label.strip(), d["art"]))
+            except ValueError as e:
+                raise HTTPError(400, str(e))
+        game = self.registry.get(access_id)
+        with game.lock:
+            if keys is not None:
+                available = {*PATTERNS, *game.custom_patterns, *(pattern.key for pattern in new_patterns)}
+                unknown = [key for key in keys if key not in available]
+                if unknown:
+                    raise HTTPError(400, f"知らない形のキーです: {', '.join(unknown)}")
+            try:
+                for pattern in new_patterns:
+                    game.add_custom_pattern(pattern)
+                if keys is not None:
+                    game.set_patterns(keys)
+            except ValueError as e:  # 同時に選べる形の数を超えた
+                raise HTTPError(400, str(e))
+            response = _patterns_response(game)
+        self.registry.note_write(access_id)
+        return response
+
+    def winners(self, access_id):
+        game = self.registry.get(access_id)
+        with game.lock:
+            # /calls や SSE と同じく、bingo_lines のキーではなく表示名で返す
+            winners = game.winners()
+        return {"winners": [{"card_number": card_number, "lines": lines}
+                            for card_number, lines in sorted(winners, key=lambda w: card_number_key(w[0]))]}
+
+    def reach(self, access_id):
+        game = self.registry.get(access_id)
+        with game.lock:
+            reach = game.number_index.reach
+            return {
+                "reach_cards": sorted(reach.reach_cards(), key=card_number_key),
+                "numbers_to_win": [{"number": number, "card_numbers": cards}
+                                   for number, cards in reach.numbers_to_win()],
+            }
+
+    def changes(self, access_id, since):
+        """ジャーナルのバージョン since より後のレコード（他の端末・プロセスの変更も含む）"""
+        game = self.registry.get(access_id)
+        if game.journal is None:
+            raise HTTPError(404, "このゲームはジャーナルを使っていません")
+        with game.lock:
+            events = game.journal.events_since(since)
+            if events is None:
+                raise HTTPError(410, f"バージョン {since} からの変更は残っていません。状態を読み込み直してください")
+            return {"version": game.journal.version, "events": events}
+
+    def history_events(self, access_id):
+        """
+        呼ばれた番号の履歴（DrawHistory）で前回から増えたレコードをイベントにする
+        画面や他のプロセスで呼んだ番号も、このサービスで呼んだ番号と同じ形で配信できる
+        初めて呼ばれたときは今の位置を覚えるだけで、それより前のレコードは配信しない
+        :return: [(イベント名, データ), ...]
+        """
+        game = self.registry.get(access_id)
+        with game.lock:
+            history = game.history
+            if history is None:
+                return []
+            history.refresh()
+            records = history.records
+            start = self.cursors.get(access_id)
+            if start is None or start > len(records):  # 購読の開始、または履歴が作り直された
+                start = len(records)
+            self.cursors[access_id] = len(records)
+            records = records[start:]
+        events = []
+        for record in records:
+            if record['op'] == 'call':
+                number = record['number']
+                events.append(("call", {"number": number, "draw": record['draw']}))
+                events.extend(("bingo", dict(win, number=number)) for win in record.get('winners', ()))
+                events.extend(("pattern", dict(win, number=number)) for win in record.get('patterns', ()))
+            elif record['op'] == 'retract':
+                events.append(("retract", {"number": record['number']}))
+        return events
+
+    # ---- イベントの配信（イベントループの中だけで呼ぶ）----
+
+    async def catch_up(self, access_id):
+        """購読者がいれば、履歴の増えた分をすぐに配信する"""
+        if self.subscribers.get(access_id):
+            self.publish(access_id, await asyncio.to_thread(self.history_events, access_id))
+
+    async def _follow(self, access_id):
+        """購読者がいるあいだ、他の書き手が履歴に追記した分を配信し続ける"""
+        try:
+            while self.subscribers.get(access_id):
+                await asyncio.sleep(FOLLOW_INTERVAL)
+                try:
+                    await self.catch_up(access_id)
+                except Exception:  # 読み込みに失敗しても次の回でやり直す
+                    pass
+        finally:
+            self.followers.pop(access_id, None)
+            if not self.subscribers.get(access_id):
+                self.cursors.pop(access_id, None)
+
+    def publish(self, access_id, events):
+        subscribers = self.subscribers.get(access_id, set())
+        for subscriber in list(subscribers):
+            for event in events:
+                try:
+                    subscriber.queue.put_nowait(event)
+                except asyncio.QueueFull:
+                    subscriber.closed = True
+                    subscribers.discard(subscriber)
+                    break
+
+    async def _stream(self, access_id, writer):
+        if access_id not in self.cursors:
+            await asyncio.to_thread(self.history_events, access_id)  # ここから後のレコードだけを配信する
+        subscriber = _Subscriber()
+        subscribers = self.subscribers.setdefault(access_id, set())
+        subscribers.add(subscriber)
+        if access_id not in self.followers:
+            self.followers[access_id] = asyncio.create_task(self._follow(access_id))
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream; charset=utf-8\r\n"
+            b"Cache-Control: no-cache\r\nConnection: close\r\nAccess-Control-Allow-Origin: *\r\n\r\n"
+        )
+        try:
+            await writer.drain()
+            while not subscriber.closed:
+                try:
+                    name, data = await asyncio.wait_for(subscriber.queue.get(), HEARTBEAT)
+                except asyncio.TimeoutError:
+                    writer.write(b": heartbeat\n\n")
+                else:
+                    payload = json.dumps(data, ensure_ascii=False)
+                    writer.write(f"event: {name}\ndata: {payload}\n\n".encode("utf-8"))
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            subscribers.discard(subscriber)
+
+    # ---- HTTP ----
+
+    async def _dispatch(self, method, path, body, content_type, query=""):
+        """:return: (ステータス, 応答のJSON)"""
+        parts = [unquote(part) for part in path.strip("/").split("/")]
+        if len(parts) < 2 or parts[0] != "games":
+            raise HTTPError(404, "見つかりません")
+        access_id, rest = parts[1], parts[2:]
+        if not ACCESS_ID.match(access_id):
+            raise HTTPError(400, "アクセスIDは半角英数字と - _ で指定してください")
+
+        if rest == [] and method == "GET":
+            return 200, await asyncio.to_thread(self.state, access_id)
+        if rest == ["cards"] and method == "POST":
+            return 200, await asyncio.to_thread(self.register, access_id, body, content_type)
+        if len(rest) == 2 and rest[0] == "cards" and method == "DELETE":
+            return 200, await asyncio.to_thread(self.delete_card, access_id, rest[1])
+        if rest == ["calls"] and method == "POST":
+            request = _load_json(body)
+            numbers = request.get("numbers", [request["number"]] if "number" in request else None)
+            if not isinstance(numbers, list) or not numbers:
+                raise HTTPError(400, "number か numbers を指定してください")
+            response = await asyncio.to_thread(self.call, access_id, [_parse_number(n) for n in numbers])
+            await self.catch_up(access_id)
+            return 200, response
+        if len(rest) == 2 and rest[0] == "calls" and method == "DELETE":
+            response = await asyncio.to_thread(self.retract, access_id, _parse_number(rest[1]))
+            await self.catch_up(access_id)
+            return 200, response
+        if rest == ["winners"] and method == "GET":
+            return 200, await asyncio.to_thread(self.winners, access_id)
+        if rest == ["reach"] and method == "GET":
+            return 200, await asyncio.to_thread(self.reach, access_id)
+        if rest == ["patterns"] and method == "GET":
+            return 200, await asyncio.to_thread(self.patterns, access_id)
+        if rest == ["patterns"] and method == "POST":
+            return 200, await asyncio.to_thread(self.set_patterns, access_id, _load_json(body))
+        if rest == ["changes"] and method == "GET":
+            since = parse_qs(query).get("since", ["0"])[0]
+            if not since.isdigit():
+                raise HTTPError(400, "since はバージョン（0以上の整数）で指定してください")
+            return 200, await asyncio.to_thread(self.changes, access_id, int(since))
+        if rest and rest[0] in ("cards", "calls", "winners", "reach", "patterns", "changes", "events"):
+            raise HTTPError(405, f"{method} は使えません")
+        raise HTTPError(404, "見つかりません")
+
+    async def handle(self, reader, writer):
+        """1つの接続で届くリクエストを順に処理する（keep-alive 対応）"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode("latin-1").split(maxsplit=2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0) or 0)
+                keep_alive = version.strip() == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                if length > MAX_BODY:
+                    await self._respond(writer, 413, {"error": "リクエストが大きすぎます"}, False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                url = urlsplit(target)
+                path = url.path
+
+                if method == "GET" and re.fullmatch(r"/games/[^/]+/events/?", path):
+                    access_id = unquote(path.split("/")[2])
+                    if ACCESS_ID.match(access_id):
+                        await self._stream(access_id, writer)
+                        break
+                if method == "OPTIONS":
+                    await self._respond(writer, 204, None, keep_alive)
+                    continue
+                try:
+                    status, response = await self._dispatch(method, path, body, headers.get("content-type", ""),
+                                                            url.query)
+                except HTTPError as e:
+                    status, response = e.status, {"error": e.message}
+                except Exception as e:  # サービスを落とさずに 500 を返す
+                    status, response = 500, {"error": f"{type(e).__name__}: {e}"}
+                await self._respond(writer, status, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, response, keep_alive):
+        payload = b"" if response is None else json.dumps(response, ensure_ascii=False).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\nContent-Length: {len(payload)}\r\n"
+            "Access-Control-Allow-Origin: *\r\nAccess-Control-Allow-Methods: GET, POST, DELETE, OPTIONS\r\n"
+            "Access-Control-Allow-Headers: Content-Type\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + payload
+        )
+        await writer.drain()
+
+    async def serve(self, host=HOST, port=PORT):
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+def _patterns_response(game):
+    """game.lock を持って呼ぶ"""
+    return {
+        "selected": [{"key": pattern.key, "label": pattern.label} for pattern in game.patterns.patterns],
+        "available": [{"key": key, "label": pattern.label}
+                      for key, pattern in {**PATTERNS, **game.custom_patterns}.items()],
+    }
+
+
+def _load_json(body):
+    try:
+        request = json.loads(body or b"{}")
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise HTTPError(400, "JSONとして読めません")
+    if not isinstance(request, dict):
+        raise HTTPError(400, "JSONのオブジェクトで指定してください")
+    return request
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ビンゴ判定の HTTP/JSON サービス")
+    parser.add_argument("--host", default=HOST, help="待ち受けるアドレス（既定はこのPCからだけ）")
+    parser.add_argument("--port", type=int, default=PORT, help="ポート番号")
+    args = parser.parse_args(argv)
+    print(f"http://{args.host}:{args.port}/games/{{アクセスID}} で待ち受けています", flush=True)
+    try:
+        asyncio.run(BingoService().serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+NumPyで全カードをまとめて扱うカードストア
+数字は (N, 5, 5) の整数配列、マーク状態は同じ形の bool 配列で持ち、
+番号のマークとビンゴ判定を全カードに対して1回の配列演算で行う
+
+@author: egumon
+"""
+
+import numpy as np
+
+from bingo_engine.lines import LINES, LINE_KEYS, LINE_LABELS, LINE_MASKS
+
+_LINE_MASKS = np.array([mask for _, _, mask in LINE_MASKS], dtype=np.uint32)
+
+# (25, 12): マス i*5+j がライン k を通るなら 1
+_CELL_LINE_MATRIX = np.array(
+    [[1 if (i, j) in cells else 0 for _, _, cells in LINES] for i in range(5) for j in range(5)],
+    dtype=np.int8,
+)
+
+
+def _count_remaining(marked):
+    """(N, 5, 5) のマーク状態から、各ラインの未マークのマス数 (N, 12) を数える"""
+    n = len(marked)
+    return (5 - marked.reshape(n, 25).astype(np.int8) @ _CELL_LINE_MATRIX).astype(np.int8)
+
+
+# FREE だけがマークされたカードの残りマス数（FREE を通るラインは4、それ以外は5）
+_FREE_REMAINING = 5 - _CELL_LINE_MATRIX[12]
+
+
+class CardStore:
+    backend = "array"  # bingo_engine.engine のバックエンド名
+
+    def __init__(self, card_numbers=(), numbers=None):
+        """
+        カードストアを初期化する
+        :param card_numbers: カード番号のリスト
+        :param numbers: (N, 5, 5) の数字配列（0は FREE スペース）
+        """
+        self.card_numbers = list(card_numbers)
+        n = len(self.card_numbers)
+        if numbers is None:
+            numbers = np.zeros((n, 5, 5), dtype=np.uint8)
+        self.numbers = np.asarray(numbers, dtype=np.uint8).reshape(n, 5, 5)
+        self.marked = np.zeros((n, 5, 5), dtype=bool)
+        self.marked[:, 2, 2] = True  # FREE space
+        # 成立済みライン (N, 12)。BingoCard.bingo_lines に相当する
+        self.won = np.zeros((n, len(LINES)), dtype=bool)
+        # 各ラインの残りマス数 (N, 12)。マークしたマスを通るラインだけを減らす
+        self.remaining = np.tile(_FREE_REMAINING, (n, 1))
+        self.positions = {number: i for i, number in enumerate(self.card_numbers)}
+
+    def __len__(self):
+        return len(self.card_numbers)
+
+    @classmethod
+    def from_dicts(cls, data):
+        """
+        to_dict 形式（save_cards が書き出すJSONの中身）から作る
+        :param data: {"card_number", "numbers", "marked", "bingo_lines"} の辞書のリスト
+        """
+        store = cls([d['card_number'] for d in data], [d['numbers'] for d in data])
+        if data:
+            store.marked[:] = np.array([d['marked'] for d in data], dtype=bool)
+            store.remaining = store.count_remaining()
+            for k, key in enumerate(LINE_KEYS):
+                store.won[:, k] = [key in d['bingo_lines'] for d in data]
+        return store
+
+    def to_dicts(self):
+        """to_dict 形式の辞書のリストに変換する"""
+        return [
+            {
+                "card_number": card_number,
+                "numbers": self.numbers[i].tolist(),
+                "marked": self.marked[i].tolist(),
+                "bingo_lines": [LINE_KEYS[k] for k in np.flatnonzero(self.won[i])]
+            }
+            for i, card_number in enumerate(self.card_numbers)
+        ]
+
+    def replay(self, records):
+        """
+        ジャーナルのレコード（GameJournal.read が返すもの）を適用する
+        2回適用しても結果が変わらない点は journal.replay と同じ
+        """
+        for record in records:
+            op = record['op']
+            if op == 'add':
+                card = record['card']
+                if card['card_number'] not in self.positions:
+                    self.add_cards([card['card_number']], [card['numbers']])
+            elif op == 'delete':
+                if record['card_number'] in self.positions:
+                    self.remove_card(record['card_number'])
+            elif op == 'call':
+                self.call(record['number'])
+            elif op == 'retract':
+                self.retract(record['number'])
+        return self
+
+    def add_cards(self, card_numbers, numbers):
+        """
+        カードをまとめて追加する
+        :param card_numbers: 追加するカード番号のリスト
+        :param numbers: (M, 5, 5) の数字配列
+        """
+        added = CardStore(card_numbers, numbers)
+        for card_number in added.card_numbers:
+            if card_number in self.positions:
+                raise ValueError(f"カード番号 {card_number} は既に登録されています")
+        offset = len(self.card_numbers)
+        self.card_numbers.extend(added.card_numbers)
+        self.numbers = np.concatenate([self.numbers, added.numbers])
+        self.marked = np.concatenate([self.marked, added.marked])
+        self.won = np.concatenate([self.won, added.won])
+        self.remaining = np.concatenate([self.remaining, added.remaining])
+        for i, card_number in enumerate(added.card_numbers):
+            self.positions[card_number] = offset + i
+
+    def remove_card(self, card_number):
+        """カードを削除する"""
+        i = self.positions.pop(card_number)
+        del self.card_numbers[i]
+        self.numbers = np.delete(self.numbers, i, axis=0)
+        self.marked = np.delete(self.marked, i, axis=0)
+        self.won = np.delete(self.won, i, axis=0)
+        self.remaining = np.delete(self.remaining, i, axis=0)
+        for k in range(i, len(self.card_numbers)):
+            self.positions[self.card_numbers[k]] = k
+
+    def count_remaining(self):
+        """マーク状態から各ラインの残りマス数を数え直す（マーク状態を直接差し替えた後に使う）"""
+        return _count_remaining(self.marked)
+
+    def mark_number(self, number):
+        """
+        呼ばれた番号を全カードに対してマークし、マークしたマスを通るラインの残り数を減らす
+        :param number: 呼ばれた番号（1-75）
+        :return: 新しくマークされたカードの添字の配列
+        """
+        n = len(self.card_numbers)
+        hit = (self.numbers == number) & ~self.marked
+        cards, cells = np.nonzero(hit.reshape(n, 25))
+        self.marked.reshape(n, 25)[cards, cells] = True
+        # np.nonzero はカード順に並ぶので、同じカードが続かなければ通常の添字演算で足りる
+        if np.any(cards[1:] == cards[:-1]):
+            np.subtract.at(self.remaining, cards, _CELL_LINE_MATRIX[cells])
+            cards = np.unique(cards)
+        else:
+            self.remaining[cards] -= _CELL_LINE_MATRIX[cells]
+        return cards
+
+    def retract(self, number):
+        """
+        呼ばれた番号を取り消す。その番号のマスのマークを外し、
+        そのマスを通るラインの残り数を戻して、成立済みだったビンゴを取り消す
+        :return: マークを外したカードの添字の配列
+        """
+        n = len(self.card_numbers)
+        hit = (self.numbers == number) & self.marked
+        hit[:, 2, 2] = False  # FREE space
+        cards, cells = np.nonzero(hit.reshape(n, 25))
+        self.marked.reshape(n, 25)[cards, cells] = False
+        np.add.at(self.remaining, cards, _CELL_LINE_MATRIX[cells])
+        cards = np.unique(cards)
+        self.won[cards] &= self.remaining[cards] == 0
+        return cards
+
+    def masks(self, indices=None):
+        """
+        マーク状態を25bitの整数に詰める（マス(i, j) がビット i*5+j。特別な形の判定にも使う）
+        :return: (N,) の uint32 配列
+        """
+        marked = self.marked if indices is None else self.marked[indices]
+        packed = np.packbits(marked.reshape(len(marked), 25), axis=1, bitorder='little')
+        return packed.view('<u4').ravel()
+
+    def set_masks(self, masks, indices=None):
+        """
+        masks の逆。25bitの整数からマーク状態を戻し、各ラインの残りマス数を数え直す
+        :param indices: 対象カードの添字（None なら全カード）
+        """
+        bits = np.asarray(masks, dtype='<u4').reshape(-1, 1).view(np.uint8)
+        marked = np.unpackbits(bits, axis=1, count=25, bitorder='little').astype(bool).reshape(-1, 5, 5)
+        if indices is None:
+            self.marked[:] = marked
+            self.remaining = self.count_remaining()
+        else:
+            self.marked[indices] = marked
+            self.remaining[indices] = _count_remaining(marked)
+
+    def line_status(self, indices=None):
+        """
+        各カードの12本のラインが埋まっているかをマーク状態から計算し直す
+        （通常の判定は remaining を使うので、検算や読み込み直後の確認用）
+        :param indices: 対象カードの添字（None なら全カード）
+        :return: (N, 12) の bool 配列。列の並びは LINES と同じ
+        """
+        # 25マスを25bitの整数に詰めてから、12本のラインマスクと一括で比較する
+        bits = self.masks(indices)
+        return (bits[:, None] & _LINE_MASKS) == _LINE_MASKS
+
+    def check_bingo(self, indices=None):
+        """
+        新しく成立したビンゴを判定する（残り数が0になったラインのうち未報告のもの）
+        :param indices: 対象カードの添字（None なら全カード）
+        :return: [(カード番号, [パターン名, ...]), ...]。パターン名は BingoCard.check_bingo と同じ
+        """
+        if indices is None:
+            new = (self.remaining == 0) & ~self.won
+            self.won |= new
+        else:
+            new = (self.remaining[indices] == 0) & ~self.won[indices]
+            self.won[indices] |= new
+        results = []
+        for r in np.flatnonzero(new.any(axis=1)):
+            patterns = [LINE_LABELS[k] for k in np.flatnonzero(new[r])]
+            i = r if indices is None else indices[r]
+            results.append((self.card_numbers[i], patterns))
+        return results
+
+    def winners(self):
+        """
+        今ビンゴになっているラインを全部返す（報告済みかどうかは問わない）
+        :return: [(カード番号, [パターン名, ...]), ...]
+        """
+        return [
+            (self.card_numbers[i], [LINE_LABELS[k] for k in np.flatnonzero(self.won[i])])
+            for i in np.flatnonzero(self.won.any(axis=1))
+        ]
+
+    def call(self, number):
+        """
+        番号をマークし、その番号でマークされたカードだけをビンゴ判定する
+        （マークされなかったカードに新しいビンゴは発生しない）
+        :return: [(カード番号, [パターン名, ...]), ...]
+        """
+        return self.check_bingo(self.mark_number(number))